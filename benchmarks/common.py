@@ -0,0 +1,118 @@
+"""Общие части бенчмарков: тестовая база и наполнение ее данными.
+
+Бенчмарки работают на временной базе, которую создает тестовый раннер
+Django, поэтому db.sqlite3 они не трогают.
+"""
+import copy
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+
+import django
+
+
+def setup(settings_module='yatube.settings'):
+    """Поднимает Django и тестовую базу, возвращает функцию для их закрытия"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+    from django.conf import settings
+    from django.test.utils import (override_settings, setup_databases,
+                                   setup_test_environment,
+                                   teardown_databases,
+                                   teardown_test_environment)
+
+    # как на боевом сервере: без debug toolbar и с кэшем шаблонов;
+    # загрузчики выбираются при импорте настроек, поэтому задаем их явно
+    setup_test_environment(debug=False)
+    templates = copy.deepcopy(settings.TEMPLATES)
+    templates[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', settings.TEMPLATE_LOADERS),
+    ]
+    cached_templates = override_settings(TEMPLATES=templates)
+    cached_templates.enable()
+    old_config = setup_databases(verbosity=0, interactive=False)
+
+    def teardown():
+        teardown_databases(old_config, verbosity=0)
+        cached_templates.disable()
+        teardown_test_environment()
+
+    return teardown
+
+
+def seed(users=1000, groups=20, posts=20000, comments=40000, follows=10000,
+         batch_size=500, random_seed=0):
+    """Заполняет базу пользователями, группами, постами и подписками"""
+    from django.contrib.auth import get_user_model
+    from django.utils import timezone
+
+    from posts.counters import rebuild_counters
+    from posts.models import Comment, Follow, Group, Post
+    from posts.transfer import manual_dates
+
+    User = get_user_model()
+    rng = random.Random(random_seed)
+    now = timezone.now()
+
+    User.objects.bulk_create(
+        [User(username=f'user{number}') for number in range(users)],
+        batch_size=batch_size,
+    )
+    user_ids = list(User.objects.values_list('id', flat=True))
+    Group.objects.bulk_create(
+        [Group(title=f'Группа {number}', slug=f'group-{number}',
+               description='Описание группы')
+         for number in range(groups)],
+        batch_size=batch_size,
+    )
+    group_ids = list(Group.objects.values_list('id', flat=True))
+
+    with manual_dates(Post._meta.get_field('pub_date'),
+                      Comment._meta.get_field('created')):
+        Post.objects.bulk_create(
+            [Post(text=f'Текст поста {number}',
+                  author_id=rng.choice(user_ids),
+                  group_id=rng.choice(group_ids + [None]),
+                  pub_date=now - timedelta(minutes=posts - number))
+             for number in range(posts)],
+            batch_size=batch_size,
+        )
+        post_ids = list(Post.objects.values_list('id', flat=True))
+        Comment.objects.bulk_create(
+            [Comment(text=f'Комментарий {number}',
+                     post_id=rng.choice(post_ids),
+                     author_id=rng.choice(user_ids),
+                     created=now - timedelta(seconds=comments - number))
+             for number in range(comments)],
+            batch_size=batch_size,
+        )
+
+    pairs = set()
+    while len(pairs) < min(follows, len(user_ids) * (len(user_ids) - 1)):
+        user, author = rng.sample(user_ids, 2)
+        pairs.add((user, author))
+    Follow.objects.bulk_create(
+        [Follow(user_id=user, author_id=author) for user, author in pairs],
+        batch_size=batch_size,
+    )
+    # bulk_create не вызывает сигналы, счетчики пересчитываем разом
+    rebuild_counters()
+    return {'users': users, 'groups': groups, 'posts': posts,
+            'comments': comments, 'follows': len(pairs)}
+
+
+def measure(func, repeat=50):
+    """Время выполнения func в миллисекундах: медиана и 95-й перцентиль"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'p50': round(statistics.median(timings), 3),
+        'p95': round(timings[min(len(timings) - 1,
+                                 int(len(timings) * 0.95))], 3),
+    }
@@ -0,0 +1,95 @@
+"""Планы запросов и время лент без составных индексов и с ними.
+
+Запуск: python -m benchmarks.indexes [--posts 20000] [--repeat 50]
+"""
+import argparse
+
+from benchmarks import common
+
+
+def feed_queries():
+    from django.contrib.auth import get_user_model
+
+    from posts.models import Comment, Follow, Group, Post
+
+    user = get_user_model().objects.order_by('id').first()
+    author = Post.objects.values_list('author', flat=True).first()
+    group = Group.objects.order_by('id').first()
+    post = Post.objects.order_by('-id').first()
+    return {
+        'index': Post.objects.for_feed()[:10],
+        'group': group.posts.for_feed()[:10],
+        'profile': Post.objects.for_feed().filter(author_id=author)[:10],
+        'comments': Comment.objects.filter(post=post)[:10],
+        'follow': Post.objects.for_feed().filter(
+            author__following__in=Follow.objects.filter(user=user)
+        )[:10],
+        'followers': Follow.objects.filter(author_id=author),
+    }
+
+
+def feed_indexes():
+    from posts.models import Comment, Follow, Post
+
+    return [(model, index)
+            for model in (Post, Comment, Follow)
+            for index in model._meta.indexes]
+
+
+def query_plan(queryset):
+    from django.db import connection
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def run(repeat):
+    results = {}
+    for name, queryset in feed_queries().items():
+        results[name] = {
+            'plan': query_plan(queryset),
+            'latency': common.measure(lambda: list(queryset.all()), repeat),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    teardown = common.setup()
+    try:
+        from django.db import connection
+
+        common.seed(posts=args.posts, comments=args.posts * 2)
+        with connection.schema_editor() as editor:
+            for model, index in feed_indexes():
+                editor.remove_index(model, index)
+        connection.cursor().execute('ANALYZE')
+        before = run(args.repeat)
+
+        with connection.schema_editor() as editor:
+            for model, index in feed_indexes():
+                editor.add_index(model, index)
+        connection.cursor().execute('ANALYZE')
+        after = run(args.repeat)
+    finally:
+        teardown()
+
+    for name in before:
+        print(f'== {name}')
+        for label, result in (('без индексов', before[name]),
+                              ('с индексами', after[name])):
+            latency = result['latency']
+            print(f'  {label}: p50 {latency["p50"]} мс, '
+                  f'p95 {latency["p95"]} мс')
+            for line in result['plan']:
+                print(f'    {line}')
+
+
+if __name__ == '__main__':
+    main()
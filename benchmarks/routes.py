@@ -0,0 +1,196 @@
+"""Число запросов к базе и время ответа для каждого адреса из posts/urls.py.
+
+Наполняет временную базу, открывает каждый адрес от лица автора, который
+подписан на других, и проверяет потолки числа запросов QUERY_BUDGETS.
+Медиана и 95-й перцентиль времени ответа сравниваются с сохраненными в
+baseline.json; --update-baseline записывает новый baseline.
+
+Запуск: python -m benchmarks.routes [--update-baseline]
+"""
+import argparse
+import json
+import os
+import sys
+
+from benchmarks import common
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# потолок числа запросов для авторизованного читателя с пустым кэшем
+QUERY_BUDGETS = {
+    'index': 4,
+    'group': 5,
+    'profile': 6,
+    'post': 5,
+    'post_comments': 3,
+    'follow_index': 4,
+    'post_edit': 6,
+    'add_comment': 6,
+    'search': 5,
+    'index_feed': 1,
+    'group_feed': 2,
+    'author_feed': 2,
+    'api_posts': 1,
+    'api_post': 1,
+    'api_post_comments': 2,
+    'api_groups': 1,
+    'api_group_posts': 2,
+    'api_user': 1,
+    'api_user_posts': 2,
+    'api_follow': 3,
+}
+
+
+def route_requests(author, post, group):
+    """Имя маршрута: метод, адрес и данные запроса"""
+    from django.urls import reverse
+
+    username = author.username
+    return {
+        'index': ('get', reverse('index'), None),
+        'group': ('get', reverse('group', args=[group.slug]), None),
+        'profile': ('get', reverse('profile', args=[username]), None),
+        'post': ('get', reverse('post', args=[username, post.id]), None),
+        'post_comments': ('get',
+                          reverse('post_comments', args=[username, post.id]),
+                          None),
+        'follow_index': ('get', reverse('follow_index'), None),
+        'post_edit': ('get', reverse('post_edit', args=[username, post.id]),
+                      None),
+        'add_comment': ('post',
+                        reverse('add_comment', args=[username, post.id]),
+                        {'text': 'Комментарий из бенчмарка'}),
+        'search': ('get', reverse('search'), {'q': post.text.split()[0]}),
+        'index_feed': ('get', reverse('index_feed', args=['rss']), None),
+        'group_feed': ('get', reverse('group_feed', args=[group.slug, 'atom']),
+                       None),
+        'author_feed': ('get',
+                        reverse('author_feed', args=[username, 'json']),
+                        None),
+        'api_posts': ('get', reverse('api_posts'), None),
+        'api_post': ('get', reverse('api_post', args=[post.id]), None),
+        'api_post_comments': ('get',
+                              reverse('api_post_comments', args=[post.id]),
+                              None),
+        'api_groups': ('get', reverse('api_groups'), None),
+        'api_group_posts': ('get',
+                            reverse('api_group_posts', args=[group.slug]),
+                            None),
+        'api_user': ('get', reverse('api_user', args=[username]), None),
+        'api_user_posts': ('get', reverse('api_user_posts', args=[username]),
+                           None),
+        'api_follow': ('get', reverse('api_follow'), None),
+    }
+
+
+def sql_queries(context):
+    """Число запросов без управления транзакциями.
+
+    Представления с atomic пишут в журнал BEGIN, а внутри TestCase вместо
+    него SAVEPOINT и RELEASE; на бюджет это влиять не должно.
+    """
+    return sum(
+        not query['sql'].startswith(('BEGIN', 'SAVEPOINT', 'RELEASE',
+                                     'ROLLBACK'))
+        for query in context.captured_queries
+    )
+
+
+def count_queries(client, method, url, data):
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    cache.clear()
+    with CaptureQueriesContext(connection) as context:
+        response = getattr(client, method)(url, data)
+        if response.streaming:
+            # ленты читают базу, пока отдают тело
+            b''.join(response.streaming_content)
+    return response, sql_queries(context)
+
+
+def pick_viewer():
+    """Автор поста с группой и комментариями, подписанный на других"""
+    from posts.models import Follow, Post
+
+    post = (Post.objects.filter(group__isnull=False,
+                                comments__isnull=False,
+                                author__follower__isnull=False)
+            .select_related('author', 'group').first())
+    assert Follow.objects.filter(user=post.author).exists()
+    return post.author, post, post.group
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous and result['p95'] > previous['p95'] * tolerance:
+            regressions.append(
+                f'{name}: p95 {result["p95"]} мс, было {previous["p95"]} мс'
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Во сколько раз p95 может вырасти')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    teardown = common.setup()
+    try:
+        from django.core.cache import cache
+        from django.test import Client
+
+        common.seed(users=args.users, posts=args.posts,
+                    comments=args.posts * 2, follows=args.users * 10)
+        author, post, group = pick_viewer()
+        client = Client()
+        client.force_login(author)
+
+        failures = []
+        results = {}
+        for name, (method, url, data) in route_requests(
+                author, post, group).items():
+            response, queries = count_queries(client, method, url, data)
+            if response.status_code >= 400:
+                failures.append(f'{name}: ответ {response.status_code}')
+            if queries > QUERY_BUDGETS[name]:
+                failures.append(f'{name}: {queries} запросов, '
+                                f'потолок {QUERY_BUDGETS[name]}')
+
+            def request():
+                cache.clear()
+                getattr(client, method)(url, data)
+
+            results[name] = dict(common.measure(request, args.repeat),
+                                 queries=queries)
+            print(f'{name:>13}: {queries} запросов, '
+                  f'p50 {results[name]["p50"]} мс, '
+                  f'p95 {results[name]["p95"]} мс')
+    finally:
+        teardown()
+
+    if args.update_baseline:
+        with open(BASELINE, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f'baseline записан в {BASELINE}')
+    elif os.path.exists(BASELINE):
+        with open(BASELINE) as baseline_file:
+            failures.extend(
+                compare(results, json.load(baseline_file), args.tolerance)
+            )
+
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
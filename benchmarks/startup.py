@@ -0,0 +1,105 @@
+"""Время запуска процесса: импорт и настройка Django, WSGI и первый запрос.
+
+Каждый замер — отдельный процесс Python на временной базе, так что кэш
+импортов и шаблонов не переходит из замера в замер. Сравниваются
+настройки для разработки и боевые.
+
+Запуск: python -m benchmarks.startup [--repeat 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROFILES = ('yatube.settings', 'yatube.settings_production')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child():
+    """Один запуск: печатает время этапов в миллисекундах"""
+    started = time.perf_counter()
+    import django
+    django.setup()
+    setup_done = time.perf_counter()
+
+    from django.core.wsgi import get_wsgi_application
+    from wsgiref.util import setup_testing_defaults
+    application = get_wsgi_application()
+    wsgi_done = time.perf_counter()
+
+    environ = {'PATH_INFO': '/'}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = application(environ, lambda status, headers: statuses.append(
+        status))
+    b''.join(body)
+    body.close()
+    first_request = time.perf_counter()
+
+    print(json.dumps({
+        'setup': (setup_done - started) * 1000,
+        'wsgi': (wsgi_done - setup_done) * 1000,
+        'first_request': (first_request - wsgi_done) * 1000,
+        'total': (first_request - started) * 1000,
+        'modules': len(sys.modules),
+        'status': statuses[0],
+    }))
+
+
+def run(settings_module, database, repeat):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module,
+               YATUBE_DB=database, YATUBE_ALLOWED_HOSTS='127.0.0.1')
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.startup', '--child'],
+            cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    result = {
+        stage: round(statistics.median(run[stage] for run in runs), 1)
+        for stage in ('setup', 'wsgi', 'first_request', 'total')
+    }
+    result['modules'] = runs[-1]['modules']
+    result['status'] = runs[-1]['status']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'db.sqlite3')
+        subprocess.run(
+            [sys.executable, 'manage.py', 'migrate', '-v', '0'],
+            cwd=ROOT, check=True,
+            env=dict(os.environ, YATUBE_DB=database),
+        )
+        results = {profile: run(profile, database, args.repeat)
+                   for profile in PROFILES}
+
+    for profile, result in results.items():
+        print(f'{profile}: настройка {result["setup"]} мс, '
+              f'WSGI {result["wsgi"]} мс, '
+              f'первый запрос {result["first_request"]} мс '
+              f'({result["status"]}), всего {result["total"]} мс, '
+              f'модулей {result["modules"]}')
+    development, production = (results[profile]['total']
+                               for profile in PROFILES)
+    print(f'Боевые настройки быстрее на '
+          f'{(1 - production / development) * 100:.0f}%')
+
+
+if __name__ == '__main__':
+    main()
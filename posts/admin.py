@@ -1,11 +1,25 @@
 from django.contrib import admin
 
+from . import search
 from .models import Comment, Group, Post
 
 
-class PostAdmin(admin.ModelAdmin):
+class FullTextSearchMixin:
+    """Поиск в админке по полнотекстовому индексу вместо LIKE '%...%'"""
+    search_table = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            pk__in=search.matching_ids(self.search_table, search_term)
+        ), False
+
+
+class PostAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("pk", "text", "pub_date", "author")
     search_fields = ("text",)
+    search_table = search.POST_TABLE
     list_filter = ("pub_date",)
     empty_value_display = "-пусто-"
 
@@ -16,9 +30,10 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("text", "post", "author", "created")
     search_fields = ("text",)
+    search_table = search.COMMENT_TABLE
     empty_value_display = "-пусто-"
 
 
@@ -0,0 +1,229 @@
+"""JSON API только для чтения: посты, комментарии, группы, авторы, подписки.
+
+Параметр fields= выбирает поля ответа, и из базы читаются только нужные
+колонки; автор и группа приходят вложенными объектами из того же запроса
+через JOIN. Списки листаются курсором (?cursor=), ответы кэшируются по тем
+же версиям, что и HTML-страницы лент.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .cache import (cached_response, get_feed_version, get_follow_version,
+                    page_cache_key)
+from .models import Comment, Group, Post, User
+from .paginator import CursorPaginator
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# поле ответа: колонки values(); колонки через __ — вложенный объект
+POST_FIELDS = {
+    'id': ('id',),
+    'text': ('text',),
+    'pub_date': ('pub_date',),
+    'image': ('image',),
+    'comment_count': ('comment_count',),
+    'author': ('author__id', 'author__username'),
+    'group': ('group__id', 'group__slug', 'group__title'),
+}
+COMMENT_FIELDS = {
+    'id': ('id',),
+    'text': ('text',),
+    'created': ('created',),
+    'post': ('post_id',),
+    'author': ('author__id', 'author__username'),
+}
+GROUP_FIELDS = {
+    'id': ('id',),
+    'title': ('title',),
+    'slug': ('slug',),
+    'description': ('description',),
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _requested_fields(request, spec):
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(spec)
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in spec]
+    if unknown:
+        raise BadRequest(f'Неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest('limit должен быть числом')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _serialize(row, fields, spec):
+    data = {}
+    for name in fields:
+        columns = spec[name]
+        if '__' not in columns[0]:
+            value = row[columns[0]]
+            if name == 'image':
+                value = f'{settings.MEDIA_URL}{value}' if value else None
+            data[name] = value
+            continue
+        nested = {column.split('__', 1)[1]: row[column] for column in columns}
+        has_value = any(value is not None for value in nested.values())
+        data[name] = nested if has_value else None
+    return data
+
+
+def _columns(fields, spec, extra=()):
+    columns = list(extra)
+    for name in fields:
+        columns.extend(column for column in spec[name]
+                       if column not in columns)
+    return columns
+
+
+def _page_url(request, cursor):
+    if cursor is None:
+        return None
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+
+def _list(request, queryset, spec, ordering=('-pub_date', '-id')):
+    fields = _requested_fields(request, spec)
+    sort_columns = [name.lstrip('-') for name in ordering]
+    rows = queryset.values(*_columns(fields, spec, sort_columns))
+    paginator = CursorPaginator(rows, _limit(request), ordering)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return JsonResponse({
+        'results': [_serialize(row, fields, spec) for row in page],
+        'next': _page_url(request, page.next_cursor),
+        'previous': _page_url(request, page.previous_cursor),
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+def _detail(request, queryset, spec):
+    fields = _requested_fields(request, spec)
+    row = queryset.values(*_columns(fields, spec)).first()
+    if row is None:
+        return _error('Не найдено', 404)
+    return JsonResponse(_serialize(row, fields, spec),
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def api_view(name, version=lambda request: get_feed_version()):
+    """Ответ из общего кэша лент; ошибки запроса не кэшируются"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return _error('Метод не поддерживается', 405)
+
+            def render():
+                try:
+                    return view(request, *args, **kwargs)
+                except BadRequest as error:
+                    return _error(str(error), 400)
+
+            if version is None:
+                return render()
+            key = page_cache_key(f'api:{name}', request, version(request))
+            return cached_response(request, key, render,
+                                   settings.FEED_CACHE_TIMEOUT)
+        return wrapper
+    return decorator
+
+
+@api_view('posts')
+def post_list(request):
+    return _list(request, Post.objects.all(), POST_FIELDS)
+
+
+@api_view('post')
+def post_detail(request, post_id):
+    return _detail(request, Post.objects.filter(pk=post_id), POST_FIELDS)
+
+
+@api_view('comments')
+def post_comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        return _error('Пост не найден', 404)
+    return _list(request, Comment.objects.filter(post_id=post_id),
+                 COMMENT_FIELDS, ordering=('-created', '-id'))
+
+
+@api_view('groups')
+def group_list(request):
+    return _list(request, Group.objects.all(), GROUP_FIELDS,
+                 ordering=('id',))
+
+
+@api_view('group_posts')
+def group_posts(request, slug):
+    group_id = (Group.objects.filter(slug=slug)
+                .values_list('id', flat=True).first())
+    if group_id is None:
+        return _error('Группа не найдена', 404)
+    return _list(request, Post.objects.filter(group_id=group_id),
+                 POST_FIELDS)
+
+
+# счетчики меняются и от подписок, которые версию лент не трогают
+@api_view('user', version=None)
+def user_detail(request, username):
+    row = (User.objects.filter(username=username)
+           .values('id', 'username', 'stats__posts_count',
+                   'stats__followers_count', 'stats__following_count')
+           .first())
+    if row is None:
+        return _error('Автор не найден', 404)
+    return JsonResponse({
+        'id': row['id'],
+        'username': row['username'],
+        'posts_count': row['stats__posts_count'] or 0,
+        'followers_count': row['stats__followers_count'] or 0,
+        'following_count': row['stats__following_count'] or 0,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+@api_view('user_posts')
+def user_posts(request, username):
+    author_id = (User.objects.filter(username=username)
+                 .values_list('id', flat=True).first())
+    if author_id is None:
+        return _error('Автор не найден', 404)
+    return _list(request, Post.objects.filter(author_id=author_id),
+                 POST_FIELDS)
+
+
+def _follow_version(request):
+    user_id = request.user.pk
+    return f'{user_id}.{get_follow_version(user_id)}.{get_feed_version()}'
+
+
+@api_view('follow', version=_follow_version)
+def follow_feed(request):
+    return _list(
+        request,
+        Post.objects.filter(author__following__user=request.user),
+        POST_FIELDS,
+    )
+
+
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return _error('Нужна авторизация', 401)
+    return follow_feed(request)
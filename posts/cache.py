@@ -0,0 +1,236 @@
+import copy
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+FEED_VERSION_KEY = 'feed:version'
+SYNDICATION_VERSION_KEY = 'syndication:version'
+FLATPAGES_VERSION_KEY = 'flatpages:version'
+# Сколько держим блокировку на перестроение страницы и сколько ждем чужую
+REBUILD_LOCK_TIMEOUT = 10
+REBUILD_WAIT = 2
+REBUILD_POLL = 0.05
+
+
+def _new_version():
+    return time.time_ns() // 1000
+
+
+def _version_timeout():
+    """Сколько живет версия: в кэше процесса столько же, сколько страницы.
+
+    Другие воркеры о новых постах такую версию не известят, поэтому и
+    ETag по ней должен меняться сам.
+    """
+    if getattr(settings, 'CACHE_IS_SHARED', False):
+        return None
+    return settings.FEED_CACHE_TIMEOUT
+
+
+def _set_version(key):
+    cache.set(key, _new_version(), _version_timeout())
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), _version_timeout())
+        version = cache.get(key)
+    return version
+
+
+def get_feed_version():
+    return _get_version(FEED_VERSION_KEY)
+
+
+def bump_feed_version():
+    _set_version(FEED_VERSION_KEY)
+
+
+def invalidate_feeds():
+    """Сбрасывает кэш лент сразу и еще раз после фиксации транзакции.
+
+    Повторный сброс нужен, чтобы страница, собранная между сохранением
+    и коммитом, не осталась в кэше под новой версией.
+    """
+    bump_feed_version()
+    transaction.on_commit(bump_feed_version)
+
+
+def get_syndication_version():
+    return _get_version(SYNDICATION_VERSION_KEY)
+
+
+def bump_syndication_version():
+    _set_version(SYNDICATION_VERSION_KEY)
+
+
+def invalidate_syndication():
+    """Сбрасывает списки элементов RSS/Atom/JSON лент целиком.
+
+    Новые посты дочитываются в списки сами, сброс нужен при правке и
+    удалении постов и изменении групп.
+    """
+    bump_syndication_version()
+    transaction.on_commit(bump_syndication_version)
+
+
+def get_flatpages_version():
+    return _get_version(FLATPAGES_VERSION_KEY)
+
+
+def bump_flatpages_version():
+    _set_version(FLATPAGES_VERSION_KEY)
+
+
+def invalidate_flatpages():
+    """Сбрасывает кэш flatpages сразу и после коммита"""
+    bump_flatpages_version()
+    transaction.on_commit(bump_flatpages_version)
+
+
+def follow_version_key(user_id):
+    return f'follow:version:{user_id}'
+
+
+def get_follow_version(user_id):
+    """Версия ленты подписок: меняется с появлением и удалением ее постов"""
+    return _get_version(follow_version_key(user_id))
+
+
+def bump_follow_versions(user_ids, batch_size=500):
+    version = _new_version()
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), batch_size):
+        cache.set_many({follow_version_key(user_id): version
+                        for user_id in user_ids[start:start + batch_size]},
+                       _version_timeout())
+
+
+def invalidate_follow_feeds(user_ids):
+    """Сбрасывает ленты подписок читателей сразу и после коммита"""
+    user_ids = list(user_ids)
+    bump_follow_versions(user_ids)
+    transaction.on_commit(lambda: bump_follow_versions(user_ids))
+
+
+def get_or_render(key, render, timeout):
+    """Достает ответ из кэша, перестраивая его только в одном процессе"""
+    response = cache.get(key)
+    if response is not None:
+        return response
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, 1, REBUILD_LOCK_TIMEOUT):
+        deadline = time.monotonic() + REBUILD_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(REBUILD_POLL)
+            response = cache.get(key)
+            if response is not None:
+                return response
+        return render()
+
+    try:
+        response = render()
+        if response.status_code == 200 and not response.cookies:
+            cache.set(key, response, timeout)
+    finally:
+        cache.delete(lock_key)
+    return response
+
+
+def cached_response(request, key, render, timeout):
+    """Ответ для GET из кэша; HEAD только читает то, что положил GET.
+
+    Ответ на HEAD в кэш не кладем: сервер может отдать его без тела, и
+    следующий GET получил бы пустую страницу.
+    """
+    if request.method == 'HEAD':
+        response = cache.get(key)
+        return render() if response is None else response
+    return get_or_render(key, render, timeout)
+
+
+def page_cache_key(key_prefix, request, version):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'feed:{key_prefix}:{version}:{path}'
+
+
+def cached_post_page(key, build, object_list):
+    """Страница ленты, от которой в кэше хранятся разметка страниц и id постов.
+
+    build() строит paginator и страницу постов при промахе. При попадании
+    посты читаются из object_list одним запросом по первичному ключу, поэтому
+    правки и счетчики комментариев видны сразу, а ключ достаточно менять
+    только при появлении и удалении постов. Общей страницей могут
+    пользоваться все читатели, HTML у каждого свой.
+    """
+    cached = cache.get(key)
+    if cached is not None:
+        paginator, page = cached
+        paginator.object_list = object_list
+        posts = object_list.in_bulk(page.object_list)
+        page.object_list = [posts[pk] for pk in page.object_list
+                            if pk in posts]
+        return paginator, page
+
+    paginator, page = build()
+    posts = list(page.object_list)
+    # queryset ленты в кэш не кладем: число постов уже посчитано
+    frozen_paginator = copy.copy(paginator)
+    frozen_paginator.object_list = None
+    frozen_page = copy.copy(page)
+    frozen_page.paginator = frozen_paginator
+    frozen_page.object_list = [post.pk for post in posts]
+    cache.set(key, (frozen_paginator, frozen_page),
+              settings.FEED_CACHE_TIMEOUT)
+    page.object_list = posts
+    return paginator, page
+
+
+def cached_feed_page(key_prefix, timeout=None):
+    """Кэширует страницу ленты для анонимных посетителей до изменения данных"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+            key = page_cache_key(key_prefix, request, get_feed_version())
+            return cached_response(
+                request,
+                key,
+                lambda: view(request, *args, **kwargs),
+                timeout or settings.FEED_CACHE_TIMEOUT,
+            )
+        return wrapper
+    return decorator
+
+
+def _session_tag(request):
+    """Отпечаток сессии из cookie: страница зависит от того, кто смотрит"""
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not session:
+        return ''
+    return hashlib.md5(session.encode()).hexdigest()[:12]
+
+
+def feed_etag(request, *args, **kwargs):
+    """ETag страницы по версии лент, без запросов к базе"""
+    return f'{get_feed_version()}-{_session_tag(request)}'
+
+
+def feed_last_modified(request, *args, **kwargs):
+    """Время последнего изменения лент; только для анонимных посетителей.
+
+    Клиент, приславший один If-Modified-Since, не должен получить 304 на
+    страницу, сохраненную под другим пользователем.
+    """
+    if _session_tag(request):
+        return None
+    return datetime.fromtimestamp(get_feed_version() / 10 ** 6, timezone.utc)
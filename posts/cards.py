@@ -0,0 +1,50 @@
+"""Готовый HTML карточек постов, общий для всех лент.
+
+Ключ карточки содержит отпечаток всего, что в нее выводится: текст, дату,
+картинку, число комментариев, автора и группу. Правка поста, новый
+комментарий или переименование группы дают новый ключ, и старую карточку
+просто перестают читать. Ссылка "Редактировать" зависит от читателя и
+подставляется уже после кэша на место EDIT_LINK_MARKER.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import thumbnails
+
+# меняется вместе с разметкой includes/post_card.html
+CARD_VERSION = 1
+EDIT_LINK_MARKER = '<!-- post_edit_link -->'
+
+
+def card_key(post):
+    group = post.group
+    fingerprint = repr((
+        post.text,
+        post.pub_date.isoformat(),
+        post.image.name if post.image else '',
+        post.comment_count,
+        post.author.username,
+        group and (group.id, group.slug, group.title),
+    ))
+    digest = hashlib.md5(fingerprint.encode()).hexdigest()
+    return f'post_card:{CARD_VERSION}:{post.id}:{digest}'
+
+
+def render_card(post, render):
+    """HTML карточки из кэша или от render(thumbs)"""
+    key = card_key(post)
+    html = cache.get(key)
+    if html is not None:
+        return html
+    thumbs = thumbnails.ready_thumbnails(post.image)
+    html = render(thumbs)
+    # карточку с заглушкой вместо миниатюр не кэшируем: скоро будет картинка
+    if not post.image or 'card' in thumbs:
+        cache.set(key, html, settings.FEED_CACHE_TIMEOUT)
+    return html
+
+
+def is_editable_by(post, user):
+    return user is not None and user.id == post.author_id
@@ -0,0 +1,70 @@
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (Count, F, IntegerField, OuterRef, Q, Subquery,
+                              Value)
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 500
+
+# поле UserStats: модель и поле, по которому строки относятся к пользователю
+STATS_SOURCES = {
+    'posts_count': ('Post', 'author'),
+    'followers_count': ('Follow', 'author'),
+    'following_count': ('Follow', 'user'),
+}
+
+
+def _count(model, field):
+    """Подзапрос с числом строк model, у которых field равно внешнему pk"""
+    counts = (model.objects.filter(**{field: OuterRef('pk')})
+              .order_by()
+              .values(field)
+              .annotate(total=Count('pk'))
+              .values('total'))
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def _fix(queryset, actual):
+    """Обновляет поля queryset значениями actual, возвращает число правок"""
+    drift = Q()
+    for field in actual:
+        drift |= ~Q(**{field: F(f'actual_{field}')})
+    fixed = (queryset.annotate(**{f'actual_{field}': value
+                                  for field, value in actual.items()})
+             .filter(drift)
+             .count())
+    if fixed:
+        queryset.update(**actual)
+    return fixed
+
+
+def rebuild_counters(apps=global_apps):
+    """Пересчитывает все счетчики по данным таблиц.
+
+    Возвращает число исправленных постов и пользователей.
+    """
+    Comment = apps.get_model('posts', 'Comment')
+    Post = apps.get_model('posts', 'Post')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserStats = apps.get_model('posts', 'UserStats')
+
+    with transaction.atomic():
+        fixed_posts = _fix(Post.objects.all(),
+                           {'comment_count': _count(Comment, 'post')})
+
+        missing = (User.objects.filter(stats__isnull=True)
+                   .values_list('pk', flat=True))
+        batch = []
+        for user_id in missing.iterator():
+            batch.append(UserStats(user_id=user_id))
+            if len(batch) == BATCH_SIZE:
+                UserStats.objects.bulk_create(batch)
+                batch = []
+        UserStats.objects.bulk_create(batch)
+
+        fixed_users = _fix(UserStats.objects.all(), {
+            field: _count(apps.get_model('posts', model), related)
+            for field, (model, related) in STATS_SOURCES.items()
+        })
+    return fixed_posts, fixed_users
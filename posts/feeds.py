@@ -0,0 +1,244 @@
+"""RSS, Atom и JSON Feed всех постов, группы и автора.
+
+Список элементов ленты лежит в кэше и дополняется только новыми постами:
+пока версия лент не изменилась, запросов к базе нет вовсе, а после
+изменения дочитываются посты новее первого элемента. Правка и удаление
+постов и изменение групп сбрасывают все списки сразу.
+Ответ пишется потоком, по элементу за раз.
+"""
+import hashlib
+import io
+import json
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import Http404, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import feedgenerator
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.utils.text import Truncator
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from .cache import get_feed_version, get_syndication_version
+from .models import Group, Post, User
+
+FEED_ITEMS = 50
+
+
+class StreamingRssFeed(feedgenerator.Rss201rev2Feed):
+    def stream(self, outfile):
+        handler = SimplerXMLGenerator(outfile, 'utf-8')
+        handler.startDocument()
+        handler.startElement('rss', self.rss_attributes())
+        handler.startElement('channel', self.root_attributes())
+        self.add_root_elements(handler)
+        yield
+        for item in self.items:
+            handler.startElement('item', self.item_attributes(item))
+            self.add_item_elements(handler, item)
+            handler.endElement('item')
+            yield
+        self.endChannelElement(handler)
+        handler.endElement('rss')
+        yield
+
+
+class StreamingAtomFeed(feedgenerator.Atom1Feed):
+    def stream(self, outfile):
+        handler = SimplerXMLGenerator(outfile, 'utf-8')
+        handler.startDocument()
+        handler.startElement('feed', self.root_attributes())
+        self.add_root_elements(handler)
+        yield
+        for item in self.items:
+            handler.startElement('entry', self.item_attributes(item))
+            self.add_item_elements(handler, item)
+            handler.endElement('entry')
+            yield
+        handler.endElement('feed')
+        yield
+
+
+class StreamingJSONFeed(feedgenerator.SyndicationFeed):
+    """JSON Feed 1.1, https://www.jsonfeed.org/version/1.1/"""
+    content_type = 'application/feed+json; charset=utf-8'
+
+    def stream(self, outfile):
+        header = json.dumps({
+            'version': 'https://jsonfeed.org/version/1.1',
+            'title': self.feed['title'],
+            'home_page_url': self.feed['link'],
+            'feed_url': self.feed['feed_url'],
+            'description': self.feed['description'],
+        }, ensure_ascii=False)
+        outfile.write(header[:-1] + ', "items": [')
+        yield
+        for number, item in enumerate(self.items):
+            if number:
+                outfile.write(', ')
+            outfile.write(json.dumps({
+                'id': item['unique_id'],
+                'url': item['link'],
+                'title': item['title'],
+                'content_text': item['description'],
+                'date_published': item['pubdate'].isoformat(),
+                'authors': [{'name': item['author_name'],
+                             'url': item['author_link']}],
+                'tags': list(item['categories']),
+            }, ensure_ascii=False))
+            yield
+        outfile.write(']}')
+        yield
+
+
+FORMATS = {
+    'rss': StreamingRssFeed,
+    'atom': StreamingAtomFeed,
+    'json': StreamingJSONFeed,
+}
+
+
+def _item(post):
+    link = reverse('post', args=[post.author.username, post.id])
+    first_line = post.text.splitlines()[0] if post.text else ''
+    return {
+        'id': post.id,
+        'title': Truncator(first_line).chars(80),
+        'link': link,
+        'description': post.text,
+        'author_name': post.author.username,
+        'author_link': reverse('profile', args=[post.author.username]),
+        'pubdate': post.pub_date,
+        'categories': [post.group.title] if post.group else [],
+    }
+
+
+def _newer(head):
+    return Q(pub_date__gt=head['pubdate']) | Q(pub_date=head['pubdate'],
+                                               id__gt=head['id'])
+
+
+def get_items(scope_key, load_scope):
+    """Шапка ленты и элементы из кэша, дополненные новыми постами.
+
+    load_scope() возвращает шапку и queryset постов ленты; вызывается только
+    при промахе и после изменения лент.
+    """
+    syndication_version = get_syndication_version()
+    key = f'syndication:{syndication_version}:{scope_key}'
+    feed_version = get_feed_version()
+    entry = cache.get(key)
+    if entry is not None and entry['feed_version'] == feed_version:
+        return entry
+
+    info, posts = load_scope()
+    posts = posts.for_feed()
+    if entry is None:
+        items = [_item(post) for post in posts[:FEED_ITEMS]]
+    else:
+        items = entry['items']
+        if items:
+            posts = posts.filter(_newer(items[0]))
+        items = ([_item(post) for post in posts[:FEED_ITEMS]]
+                 + items)[:FEED_ITEMS]
+    entry = dict(info, items=items, feed_version=feed_version,
+                 syndication_version=syndication_version)
+    cache.set(key, entry, settings.FEED_CACHE_TIMEOUT)
+    return entry
+
+
+def _drain(feed):
+    buffer = io.StringIO()
+    for _ in feed.stream(buffer):
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if chunk:
+            yield chunk
+
+
+def _last_modified(entry):
+    changed = datetime.fromtimestamp(
+        entry['syndication_version'] / 10 ** 6, timezone.utc
+    )
+    if entry['items']:
+        changed = max(changed, entry['items'][0]['pubdate'])
+    return changed.timestamp()
+
+
+def feed_response(request, fmt, scope_key, load_scope):
+    feed_class = FORMATS.get(fmt)
+    if feed_class is None:
+        raise Http404('Неизвестный формат ленты')
+    entry = get_items(scope_key, load_scope)
+
+    newest = entry['items'][0]['id'] if entry['items'] else 0
+    etag = quote_etag(hashlib.md5(
+        f'{entry["syndication_version"]}:{newest}:{fmt}'.encode()
+    ).hexdigest())
+    last_modified = _last_modified(entry)
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is not None:
+        return response
+
+    absolute = request.build_absolute_uri
+    feed = feed_class(
+        title=entry['title'],
+        link=absolute(entry['link']),
+        description=entry['description'],
+        feed_url=absolute(request.path),
+        language='ru',
+    )
+    for item in entry['items']:
+        feed.add_item(
+            title=item['title'],
+            link=absolute(item['link']),
+            unique_id=absolute(item['link']),
+            description=item['description'],
+            author_name=item['author_name'],
+            author_link=absolute(item['author_link']),
+            pubdate=item['pubdate'],
+            categories=item['categories'],
+        )
+    response = StreamingHttpResponse(_drain(feed),
+                                     content_type=feed.content_type)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def index_feed(request, fmt):
+    def load_scope():
+        return ({'title': 'Yatube: последние обновления',
+                 'link': reverse('index'),
+                 'description': 'Новые посты всех авторов'},
+                Post.objects.all())
+    return feed_response(request, fmt, 'index', load_scope)
+
+
+def group_feed(request, slug, fmt):
+    def load_scope():
+        group = Group.objects.filter(slug=slug).first()
+        if group is None:
+            raise Http404('Группа не найдена')
+        return ({'title': f'Yatube: {group.title}',
+                 'link': reverse('group', args=[slug]),
+                 'description': group.description or group.title},
+                group.posts.all())
+    return feed_response(request, fmt, f'group:{slug}', load_scope)
+
+
+def author_feed(request, username, fmt):
+    def load_scope():
+        author = User.objects.filter(username=username).first()
+        if author is None:
+            raise Http404('Автор не найден')
+        return ({'title': f'Yatube: @{username}',
+                 'link': reverse('profile', args=[username]),
+                 'description': f'Посты автора {username}'},
+                author.posts.all())
+    return feed_response(request, fmt, f'author:{username}', load_scope)
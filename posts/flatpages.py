@@ -0,0 +1,106 @@
+"""Flatpages из кэша: страницы вроде "Об авторе" почти не меняются.
+
+Анонимным посетителям отдается готовый ответ из кэша, а при промахе —
+страница, заранее отрисованная командой prerender_flatpages, так что
+шаблоны не нужны. Рядом с файлом лежит отпечаток FlatPage, из которой он
+отрисован: файл устаревшей страницы приложение не отдает. Для вошедших
+пользователей навигация своя, поэтому из кэша берется только сама
+FlatPage. Изменение любой FlatPage сбрасывает кэш.
+"""
+import hashlib
+import os
+import shutil
+
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+
+from .cache import cached_response, get_flatpages_version
+
+
+def _key(kind, url):
+    return (f'flatpage:{kind}:{get_flatpages_version()}:'
+            f'{settings.SITE_ID}:{url}')
+
+
+def get_flatpage(url):
+    """FlatPage текущего сайта по адресу или None; отсутствие тоже в кэше"""
+    key = _key('page', url)
+    page = cache.get(key)
+    if page is None:
+        page = (FlatPage.objects.filter(url=url, sites=settings.SITE_ID)
+                .first() or False)
+        cache.set(key, page, settings.FEED_CACHE_TIMEOUT)
+    return page or None
+
+
+def prerendered_path(url, name='index.html'):
+    return os.path.join(settings.FLATPAGES_PRERENDER_DIR,
+                        url.strip('/'), name)
+
+
+def digest(page):
+    """Отпечаток всего, из чего отрисована страница"""
+    fingerprint = repr((page.url, page.title, page.content,
+                        page.enable_comments, page.template_name,
+                        page.registration_required))
+    return hashlib.md5(fingerprint.encode()).hexdigest()
+
+
+def write_prerendered(page, content):
+    path = prerendered_path(page.url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as output:
+        output.write(content)
+    with open(prerendered_path(page.url, 'digest'), 'w') as output:
+        output.write(digest(page))
+    return path
+
+
+def read_prerendered(page):
+    """HTML страницы, если он отрисован из ее текущей версии, иначе None"""
+    try:
+        with open(prerendered_path(page.url, 'digest')) as stored:
+            if stored.read() != digest(page):
+                return None
+        with open(prerendered_path(page.url), 'rb') as prerendered:
+            return prerendered.read()
+    except FileNotFoundError:
+        return None
+
+
+def clear_prerendered():
+    shutil.rmtree(settings.FLATPAGES_PRERENDER_DIR, ignore_errors=True)
+
+
+def _get_or_404(url):
+    page = get_flatpage(url)
+    if page is None:
+        raise Http404('Страница не найдена')
+    return page
+
+
+def render(request, url):
+    from django.contrib.flatpages.views import render_flatpage
+
+    return render_flatpage(request, _get_or_404(url))
+
+
+def _render_anonymous(request, url):
+    page = _get_or_404(url)
+    content = None if page.registration_required else read_prerendered(page)
+    if content is None:
+        return render(request, url)
+    return HttpResponse(content)
+
+
+def flatpage(request, url):
+    if not url.startswith('/'):
+        url = f'/{url}'
+    if (request.method not in ('GET', 'HEAD')
+            or request.user.is_authenticated):
+        return render(request, url)
+    return cached_response(request, _key('response', url),
+                           lambda: _render_anonymous(request, url),
+                           settings.FEED_CACHE_TIMEOUT)
@@ -0,0 +1,64 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from posts.transfer import FIELDS, MODELS, export_records
+
+
+class Command(BaseCommand):
+    help = ('Выгружает группы, посты, комментарии и подписки в NDJSON '
+            'или одну модель в CSV')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-',
+                            help='Файл выгрузки, "-" — стандартный вывод')
+        parser.add_argument('--format', choices=('ndjson', 'csv'),
+                            default=None,
+                            help='По умолчанию по расширению файла')
+        parser.add_argument('--model', choices=MODELS, action='append',
+                            help='Что выгружать; для CSV ровно одна модель')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Сколько строк читать из базы за раз')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        data_format = options['format'] or (
+            'csv' if output.endswith('.csv') else 'ndjson'
+        )
+        models = options['model'] or MODELS
+        if data_format == 'csv' and len(models) != 1:
+            raise CommandError('Для CSV укажите одну модель через --model')
+
+        stream = (sys.stdout if output == '-'
+                  else open(output, 'w', encoding='utf-8', newline=''))
+        try:
+            records = export_records(models, options['chunk_size'])
+            if data_format == 'csv':
+                count = self.write_csv(stream, models[0], records)
+            else:
+                count = self.write_ndjson(stream, records)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        self.stderr.write(self.style.SUCCESS(f'Выгружено записей: {count}'))
+
+    def write_ndjson(self, stream, records):
+        count = 0
+        for record in records:
+            stream.write(json.dumps(record, cls=DjangoJSONEncoder,
+                                    ensure_ascii=False))
+            stream.write('\n')
+            count += 1
+        return count
+
+    def write_csv(self, stream, model, records):
+        writer = csv.DictWriter(stream, FIELDS[model], extrasaction='ignore')
+        writer.writeheader()
+        count = 0
+        for record in records:
+            writer.writerow(record)
+            count += 1
+        return count
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate_many
+
+
+class Command(BaseCommand):
+    help = 'Готовит миниатюры картинок всех постов, у которых их еще нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Число процессов, по умолчанию по числу ядер')
+
+    def handle(self, *args, **options):
+        names = (Post.objects.exclude(image='').exclude(image__isnull=True)
+                 .values_list('image', flat=True).iterator())
+        done = failed = 0
+        for name, error in generate_many(names, options['workers']):
+            if error is None:
+                done += 1
+            else:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюры готовы: {done}, с ошибками: {failed}'
+        ))
@@ -0,0 +1,67 @@
+import csv
+import json
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.transfer import MODELS, Importer, deferred_indexes
+
+
+class Command(BaseCommand):
+    help = ('Загружает группы, посты, комментарии и подписки из NDJSON '
+            'или одну модель из CSV')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Файл, "-" — стандартный ввод')
+        parser.add_argument('--format', choices=('ndjson', 'csv'),
+                            default=None,
+                            help='По умолчанию по расширению файла')
+        parser.add_argument('--model', choices=MODELS,
+                            help='Модель записей CSV')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько записей сохранять за раз')
+        parser.add_argument('--defer-indexes', action='store_true',
+                            help='Снять составные индексы на время загрузки')
+
+    def handle(self, *args, **options):
+        path = options['input']
+        data_format = options['format'] or (
+            'csv' if path.endswith('.csv') else 'ndjson'
+        )
+        if data_format == 'csv' and not options['model']:
+            raise CommandError('Для CSV укажите модель через --model')
+
+        stream = (sys.stdin if path == '-'
+                  else open(path, encoding='utf-8', newline=''))
+        importer = Importer(options['batch_size'])
+        indexes = (deferred_indexes() if options['defer_indexes']
+                   else nullcontext())
+        try:
+            with indexes:
+                for record in self.read(stream, data_format,
+                                        options['model']):
+                    importer.add(record)
+                loaded = importer.finish()
+        except (ValueError, KeyError) as error:
+            raise CommandError(f'Ошибка в записи: {error!r}')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        summary = ', '.join(f'{name} — {loaded[name]}' for name in MODELS)
+        self.stdout.write(self.style.SUCCESS(f'Загружено: {summary}'))
+
+    def read(self, stream, data_format, model):
+        if data_format == 'csv':
+            for record in csv.DictReader(stream):
+                record['model'] = model
+                yield record
+            return
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                raise CommandError(f'Строка {number}: {error}')
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.flatpages.models import FlatPage
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from posts import flatpages
+
+
+class Command(BaseCommand):
+    help = ('Отрисовывает flatpages для анонимных посетителей в '
+            'FLATPAGES_PRERENDER_DIR; запускать на каждом сервере после '
+            'выкладки и правки страниц')
+
+    def handle(self, *args, **options):
+        flatpages.clear_prerendered()
+        pages = FlatPage.objects.filter(sites=settings.SITE_ID,
+                                        registration_required=False)
+        factory = RequestFactory()
+        for page in pages:
+            request = factory.get(page.url)
+            request.user = AnonymousUser()
+            response = flatpages.render(request, page.url)
+            path = flatpages.write_prerendered(page, response.content)
+            self.stdout.write(f'{page.url} -> {path}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Отрисовано страниц: {len(pages)}'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики постов, комментариев и подписок'
+
+    def handle(self, *args, **options):
+        fixed_posts, fixed_users = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики пересчитаны: исправлено постов — {fixed_posts}, '
+            f'пользователей — {fixed_users}'
+        ))
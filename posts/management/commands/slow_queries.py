@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from yatube.slow_queries import CACHE_KEY, is_process_local, shapes, store
+
+ORDERINGS = {
+    'total': 'total',
+    'count': 'count',
+    'max': 'max',
+}
+
+
+class Command(BaseCommand):
+    help = 'Показывает самые медленные формы запросов к базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--sort', choices=ORDERINGS, default='total',
+                            help='общее время, число запросов или худшее '
+                                 'время')
+        parser.add_argument('--clear', action='store_true',
+                            help='очистить журнал')
+
+    def handle(self, *args, **options):
+        if is_process_local():
+            raise CommandError(
+                'Журнал лежит в кэше процесса сервера, отсюда его не '
+                'прочитать; запустите сервер с YATUBE_CACHE=shared или tiered'
+            )
+        if options['clear']:
+            store().delete(CACHE_KEY)
+            self.stdout.write(self.style.SUCCESS('Журнал очищен'))
+            return
+        field = ORDERINGS[options['sort']]
+        top = sorted(shapes().items(), key=lambda item: -item[1][field])
+        if not top:
+            self.stdout.write('Медленных запросов нет')
+            return
+        for number, (key, shape) in enumerate(top[:options['limit']], 1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{number}. {shape["count"]} раз, всего '
+                f'{shape["total"] * 1000:.1f} мс, худший '
+                f'{shape["max"] * 1000:.1f} мс'
+            ))
+            self.stdout.write(f'   представление: {shape["view"]}, '
+                              f'шаблон: {shape["template"]}')
+            self.stdout.write(f'   {key}')
+            for line in shape['plan']:
+                self.stdout.write(f'   план: {line}')
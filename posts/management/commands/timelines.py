@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = ('Обрезает ленты подписок до TIMELINE_MAX_ENTRIES записей '
+            'или собирает их заново')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Собрать все ленты заново по подпискам',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            entries = timeline.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                f'Ленты собраны заново: {entries} записей'
+            ))
+            return
+        deleted = timeline.trim()
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты обрезаны: удалено {deleted} записей'
+        ))
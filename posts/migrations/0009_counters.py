@@ -0,0 +1,62 @@
+# Generated by Django 2.2.28 on 2026-10-17 21:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(model, field):
+    counts = (model.objects.filter(**{field: OuterRef('pk')})
+              .order_by()
+              .values(field)
+              .annotate(total=Count('pk'))
+              .values('total'))
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    # копия posts.counters на момент миграции: код приложения меняется,
+    # а миграция должна работать так же и на новой базе
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserStats = apps.get_model('posts', 'UserStats')
+
+    Post.objects.update(comment_count=_count(Comment, 'post'))
+    UserStats.objects.bulk_create(
+        (UserStats(user_id=user_id)
+         for user_id in User.objects.values_list('pk', flat=True)),
+        batch_size=500,
+    )
+    UserStats.objects.update(posts_count=_count(Post, 'author'),
+                             followers_count=_count(Follow, 'author'),
+                             following_count=_count(Follow, 'user'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0008_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('posts_count', models.PositiveIntegerField(default=0)),
+                ('followers_count', models.PositiveIntegerField(default=0)),
+                ('following_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# схема и заполнение индекса на момент миграции; posts.search может
+# меняться, а миграция на новой базе должна делать то же, что и раньше
+POST_TABLE = 'posts_post_fts'
+COMMENT_TABLE = 'posts_comment_fts'
+
+SCHEMA = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {POST_TABLE} USING fts5("
+    f"text, tokenize = 'unicode61 remove_diacritics 2')",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {COMMENT_TABLE} USING fts5("
+    f"text, post_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')",
+]
+
+
+def build_index(apps, schema_editor):
+    posts = apps.get_model('posts', 'Post')._meta.db_table
+    comments = apps.get_model('posts', 'Comment')._meta.db_table
+    for statement in SCHEMA:
+        schema_editor.execute(statement)
+    schema_editor.execute(f'DELETE FROM {POST_TABLE}')
+    schema_editor.execute(f'INSERT INTO {POST_TABLE} (rowid, text) '
+                          f'SELECT id, text FROM {posts}')
+    schema_editor.execute(f'DELETE FROM {COMMENT_TABLE}')
+    schema_editor.execute(f'INSERT INTO {COMMENT_TABLE} '
+                          f'(rowid, text, post_id) '
+                          f'SELECT id, text, post_id FROM {comments}')
+
+
+def drop_index(apps, schema_editor):
+    for table in (POST_TABLE, COMMENT_TABLE):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_timeline'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_index, drop_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-17 22:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_search'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ('-created',)},
+        ),
+    ]
@@ -13,6 +13,12 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты вместе с автором и группой одним запросом"""
+        return self.select_related("author", "group")
+
+
 class Post(models.Model):
     text = models.TextField(
         help_text="Введите текст поста"
@@ -24,9 +30,21 @@ class Post(models.Model):
                               blank=True, null=True, related_name="posts",
                               help_text="Название группы")
     image = models.ImageField(upload_to="posts/", blank=True, null=True)
+    # поддерживается сигналами, пересчитывается командой rebuild_counters
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ("-pub_date",)
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"],
+                         name="post_pub_date_idx"),
+            models.Index(fields=["author", "-pub_date"],
+                         name="post_author_pub_date_idx"),
+            models.Index(fields=["group", "-pub_date"],
+                         name="post_group_pub_date_idx"),
+        ]
 
     def __str__(self):
         return self.text
@@ -44,6 +62,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ("-created",)
+        indexes = [
+            models.Index(fields=["post", "-created"],
+                         name="comment_post_created_idx"),
+        ]
 
     def __str__(self):
         return self.text
@@ -59,3 +81,49 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ("user", "author",)
+        indexes = [
+            models.Index(fields=["author", "user"],
+                         name="follow_author_user_idx"),
+        ]
+
+
+class UserStats(models.Model):
+    """Счетчики автора, которые иначе пришлось бы считать через COUNT(*)"""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def of(cls, user):
+        """Счетчики пользователя; нулевые, если строки еще нет"""
+        try:
+            return user.stats
+        except cls.DoesNotExist:
+            return cls(user=user)
+
+
+class TimelineEntry(models.Model):
+    """Пост в ленте подписок читателя, разложенный при публикации"""
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="timeline"
+    )
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="timeline_entries"
+    )
+    author = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+"
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ("-pub_date", "-id")
+        unique_together = ("user", "post",)
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-id"],
+                         name="timeline_user_pub_date_idx"),
+            models.Index(fields=["user", "author"],
+                         name="timeline_user_author_idx"),
+        ]
@@ -0,0 +1,153 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, next_cursor=None,
+                 previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Постраничный вывод по ключу сортировки вместо OFFSET и COUNT(*).
+
+    Курсор хранит значения полей сортировки крайнего объекта страницы,
+    поэтому стоимость любой страницы одинакова.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.model = object_list.model
+
+    def _fields(self):
+        return [name.lstrip('-') for name in self.ordering]
+
+    def _values(self, obj):
+        # строки values() приходят словарями
+        if isinstance(obj, dict):
+            return [obj[name] for name in self._fields()]
+        return [getattr(obj, name) for name in self._fields()]
+
+    def encode_cursor(self, obj, direction):
+        values = [
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in self._values(obj)
+        ]
+        data = json.dumps([direction, values]).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Возвращает направление и значения полей или None"""
+        if not cursor:
+            return None
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            data = base64.urlsafe_b64decode(cursor + padding)
+            direction, raw_values = json.loads(data.decode())
+            if direction not in ('n', 'p'):
+                return None
+            if len(raw_values) != len(self.ordering):
+                return None
+            values = [
+                self.model._meta.get_field(name).to_python(value)
+                for name, value in zip(self._fields(), raw_values)
+            ]
+        except (binascii.Error, ValueError, TypeError, AttributeError,
+                ValidationError):
+            return None
+        # null в курсоре не дает условия для seek
+        if any(value is None for value in values):
+            return None
+        return direction, values
+
+    def _seek(self, values, reverse):
+        """Условие "строго после" values в порядке self.ordering"""
+        condition = Q()
+        equal = {}
+        for name, value in zip(self.ordering, values):
+            field = name.lstrip('-')
+            descending = name.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    @staticmethod
+    def _reverse(ordering):
+        return tuple(name[1:] if name.startswith('-') else f'-{name}'
+                     for name in ordering)
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor)
+        backwards = decoded is not None and decoded[0] == 'p'
+        queryset = self.object_list
+        if decoded is not None:
+            queryset = queryset.filter(self._seek(decoded[1], backwards))
+        ordering = self._reverse(self.ordering) if backwards else self.ordering
+        items = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if backwards:
+            items.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, decoded is not None
+
+        next_cursor = previous_cursor = None
+        if items and has_next:
+            next_cursor = self.encode_cursor(items[-1], 'n')
+        if items and has_previous:
+            previous_cursor = self.encode_cursor(items[0], 'p')
+        return CursorPage(items, self, next_cursor, previous_cursor)
+
+
+def paginate(request, object_list, per_page=POSTS_PER_PAGE, count=None):
+    """Страница ленты в режиме, выбранном в settings.POSTS_PAGINATION.
+
+    Известное заранее число объектов count избавляет от COUNT(*).
+    """
+    if getattr(settings, 'POSTS_PAGINATION', 'offset') == 'cursor':
+        paginator = CursorPaginator(object_list, per_page)
+        page = paginator.get_page(request.GET.get('cursor'))
+    else:
+        paginator = Paginator(object_list, per_page)
+        if count is not None:
+            paginator.count = count
+        page = paginator.get_page(request.GET.get('page'))
+    return paginator, page
@@ -0,0 +1,131 @@
+"""Полнотекстовый поиск по постам и комментариям на SQLite FTS5.
+
+Таблицы posts_post_fts и posts_comment_fts хранят текст под rowid, равным
+pk поста или комментария, и обновляются сигналами при каждом сохранении и
+удалении. Пост находится по своему тексту или тексту комментариев; совпадение
+в самом посте весит больше.
+"""
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+POST_TABLE = 'posts_post_fts'
+COMMENT_TABLE = 'posts_comment_fts'
+
+# во сколько раз совпадение в комментарии весит меньше совпадения в посте
+COMMENT_WEIGHT = 0.5
+
+SCHEMA = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {POST_TABLE} USING fts5("
+    f"text, tokenize = 'unicode61 remove_diacritics 2')",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {COMMENT_TABLE} USING fts5("
+    f"text, post_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')",
+]
+
+WORD_RE = re.compile(r'\w+')
+
+
+def match_expression(query):
+    """Безопасное выражение MATCH: все слова запроса, каждое как префикс.
+
+    Синтаксис FTS5 (кавычки, NEAR, OR, звездочки) из ввода не пропускается.
+    """
+    words = WORD_RE.findall(query.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def index_post(post):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {POST_TABLE} (rowid, text) '
+            f'VALUES (%s, %s)',
+            [post.pk, post.text],
+        )
+
+
+def index_comment(comment):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {COMMENT_TABLE} (rowid, text, post_id) '
+            f'VALUES (%s, %s, %s)',
+            [comment.pk, comment.text, comment.post_id],
+        )
+
+
+def unindex(table, pk):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [pk])
+
+
+def rebuild(db=connection):
+    """Заново заполняет индекс по таблицам постов и комментариев"""
+    with db.cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        cursor.execute(f'DELETE FROM {POST_TABLE}')
+        cursor.execute(f'INSERT INTO {POST_TABLE} (rowid, text) '
+                       f'SELECT id, text FROM posts_post')
+        cursor.execute(f'DELETE FROM {COMMENT_TABLE}')
+        cursor.execute(f'INSERT INTO {COMMENT_TABLE} (rowid, text, post_id) '
+                       f'SELECT id, text, post_id FROM posts_comment')
+
+
+def matching_ids(table, query):
+    """Подзапрос с pk строк table, подходящих под запрос, для фильтра pk__in"""
+    return RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s',
+                  [match_expression(query)])
+
+
+class SearchResults:
+    """Посты, найденные по запросу, в порядке релевантности.
+
+    Ведет себя как последовательность для Paginator: число результатов и
+    срез считаются в базе, а посты загружаются только для нужной страницы.
+    """
+
+    def __init__(self, query, queryset):
+        self.expression = match_expression(query)
+        self.queryset = queryset
+
+    def _ranked_sql(self):
+        sql = (
+            f'SELECT rowid AS post_id, bm25({POST_TABLE}) AS rank '
+            f'FROM {POST_TABLE} WHERE {POST_TABLE} MATCH %s '
+            f'UNION ALL '
+            f'SELECT post_id, bm25({COMMENT_TABLE}) * %s '
+            f'FROM {COMMENT_TABLE} WHERE {COMMENT_TABLE} MATCH %s'
+        )
+        return sql, [self.expression, COMMENT_WEIGHT, self.expression]
+
+    def count(self):
+        if not self.expression:
+            return 0
+        sql, params = self._ranked_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(DISTINCT post_id) FROM ({sql})',
+                           params)
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def _ids(self, offset, limit):
+        sql, params = self._ranked_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT post_id FROM ({sql}) GROUP BY post_id '
+                f'ORDER BY MIN(rank), post_id DESC LIMIT %s OFFSET %s',
+                params + [limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if not self.expression:
+            return []
+        start = index.start or 0
+        ids = self._ids(start, index.stop - start)
+        posts = self.queryset.in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
@@ -0,0 +1,164 @@
+from django.contrib.flatpages.models import FlatPage
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import search, timeline
+from .cache import (invalidate_feeds, invalidate_flatpages,
+                    invalidate_follow_feeds, invalidate_syndication)
+from .models import Comment, Follow, Group, Post, UserStats
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_feed_cache(sender, **kwargs):
+    invalidate_feeds()
+
+
+@receiver(post_save, sender=Post)
+def invalidate_syndication_on_edit(sender, instance, created, **kwargs):
+    # новые посты ленты дочитывают сами
+    if not created:
+        invalidate_syndication()
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_syndication_feeds(sender, **kwargs):
+    invalidate_syndication()
+
+
+def _shift(**deltas):
+    return {field: Greatest(F(field) + delta, Value(0))
+            for field, delta in deltas.items()}
+
+
+def change_stats(user_id, **deltas):
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **_shift(**deltas)
+    )
+    if updated or min(deltas.values()) < 0:
+        return
+    # строки еще нет: считаем по таблицам, текущее изменение уже в них
+    UserStats.objects.get_or_create(user_id=user_id, defaults={
+        'posts_count': Post.objects.filter(author_id=user_id).count(),
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    })
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, **kwargs):
+    if created:
+        change_stats(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    change_stats(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            **_shift(comment_count=1)
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id).update(
+        **_shift(comment_count=-1)
+    )
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, **kwargs):
+    if created:
+        with transaction.atomic():
+            change_stats(instance.user_id, following_count=1)
+            change_stats(instance.author_id, followers_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    with transaction.atomic():
+        change_stats(instance.user_id, following_count=-1)
+        change_stats(instance.author_id, followers_count=-1)
+
+
+def invalidate_followers_feeds(author_id):
+    invalidate_follow_feeds(
+        Follow.objects.filter(author_id=author_id)
+        .values_list('user_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Post)
+def invalidate_feeds_of_followers(sender, instance, created, **kwargs):
+    if created:
+        invalidate_followers_feeds(instance.author_id)
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_feeds_of_followers_on_delete(sender, instance, **kwargs):
+    invalidate_followers_feeds(instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follower_feed(sender, instance, **kwargs):
+    invalidate_follow_feeds([instance.user_id])
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def fill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.add_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def clean_timeline(sender, instance, **kwargs):
+    timeline.remove_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.unindex(search.POST_TABLE, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.unindex(search.COMMENT_TABLE, instance.pk)
+
+
+@receiver(post_save, sender=FlatPage)
+@receiver(post_delete, sender=FlatPage)
+@receiver(m2m_changed, sender=FlatPage.sites.through)
+def invalidate_flatpage_cache(sender, action='post_save', **kwargs):
+    if action.startswith('post_'):
+        invalidate_flatpages()
@@ -0,0 +1,48 @@
+from django import template
+
+from posts import cards
+
+register = template.Library()
+
+
+class CachedPostCardNode(template.Node):
+    def __init__(self, post, nodelist_card, nodelist_edit):
+        self.post = post
+        self.nodelist_card = nodelist_card
+        self.nodelist_edit = nodelist_edit
+
+    def render(self, context):
+        post = self.post.resolve(context)
+
+        def render_card(thumbs):
+            with context.push(thumbs=thumbs):
+                return self.nodelist_card.render(context)
+
+        html = cards.render_card(post, render_card)
+        edit_link = ''
+        if cards.is_editable_by(post, context.get('user')):
+            edit_link = self.nodelist_edit.render(context)
+        return html.replace(cards.EDIT_LINK_MARKER, edit_link)
+
+
+@register.tag
+def cached_post_card(parser, token):
+    """Кэшированная карточка поста и ссылка для автора после {% edit_link %}
+
+    {% cached_post_card post %}
+        ...<!-- post_edit_link -->...
+    {% edit_link %}
+        <a href="...">Редактировать</a>
+    {% endcached_post_card %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает один аргумент: пост'
+        )
+    nodelist_card = parser.parse(('edit_link',))
+    parser.delete_first_token()
+    nodelist_edit = parser.parse(('endcached_post_card',))
+    parser.delete_first_token()
+    return CachedPostCardNode(parser.compile_filter(bits[1]), nodelist_card,
+                              nodelist_edit)
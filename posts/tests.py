@@ -1,14 +1,44 @@
+import base64
 import io
+import json
+import os
 import tempfile
+import threading
+import time
+from concurrent.futures import Future
 
-from django.core.cache import cache
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.exceptions import ValidationError
 from django.core.files.images import ImageFile
-from django.test import Client, TestCase, override_settings
-from django.urls import reverse
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
 from PIL import Image
 
-from .models import Comment, Follow, Group, Post, User
+from benchmarks.routes import QUERY_BUDGETS, count_queries, route_requests
+from yatube.cache_backends import SQLiteCache, TieredCache
+from yatube import metrics, slow_queries
+from yatube.db_router import ReadWriteRouter, reading
+
+from . import cards, flatpages, thumbnails, write_batch
+from .cache import (get_feed_version, get_follow_version, get_or_render,
+                    page_cache_key)
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .paginator import COMMENTS_PER_PAGE
+
+
+def make_cursor(direction, values):
+    """Курсор в формате CursorPaginator с произвольными значениями"""
+    data = json.dumps([direction, values]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
 
 
 class TestStringMethods(TestCase):
@@ -35,6 +65,8 @@ class TestStringMethods(TestCase):
         self.followee.force_login(self.user2)
 
         self.client_unauth = Client()
+        # откат транзакции теста не сбрасывает версию кэша лент
+        cache.clear()
 
     def get_the_urls(self, user, post, group):
         """Вспомогательный метод для сбора url"""
@@ -137,16 +169,67 @@ class TestStringMethods(TestCase):
 
     def test_cache_on_mainpage(self):
         """Проверка работы кэша"""
-        self.client.get(reverse('index'))
+        cache.clear()
+        # HEAD в кэш не пишет, но пользуется страницей от GET
+        key = page_cache_key('index_page',
+                             RequestFactory().get(reverse('index')),
+                             get_feed_version())
+        self.client.head(reverse('index'))
+        self.assertIsNone(cache.get(key))
+        self.assertContains(self.client.get(reverse('index')), 'Последние')
+        self.assertIsNotNone(cache.get(key))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.head(reverse('index')).status_code,
+                             200)
+
         new_post = Post.objects.create(text='Пост для проверки кэширования',
                                        author=self.user,
                                        group=self.group)
         response = self.client.get(reverse('index'))
-        self.assertNotContains(response, new_post.text)
-        cache.clear()
-        response = self.client.get(reverse('index'))
         self.assertContains(response, new_post.text)
 
+        Comment.objects.create(text='комментарий', post=new_post,
+                               author=self.user2)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '1 комментариев')
+
+    def test_feed_version_expires_in_process_cache(self):
+        """Проверка, что версия лент в кэше процесса не живет вечно"""
+        for shared, expires in ((False, True), (True, False)):
+            with self.settings(CACHE_IS_SHARED=shared,
+                               FEED_CACHE_TIMEOUT=0.05):
+                cache.clear()
+                version = get_feed_version()
+                time.sleep(0.1)
+                self.assertEqual(get_feed_version() != version, expires)
+
+    def test_cache_single_flight(self):
+        """Проверка, что страницу перестраивает только один процесс"""
+        cache.clear()
+        key = 'feed:test:single-flight'
+        calls = []
+
+        def render():
+            calls.append(1)
+            return HttpResponse('новая страница')
+
+        # другой процесс уже перестраивает страницу и вот-вот положит ее в кэш
+        cache.add(f'{key}:lock', 1)
+        timer = threading.Timer(0.1, cache.set, (key, 'чужая страница'))
+        timer.start()
+        self.assertEqual(get_or_render(key, render, 60), 'чужая страница')
+        timer.join()
+        self.assertEqual(calls, [])
+
+        # блокировки нет: страницу строим сами и снимаем блокировку
+        cache.clear()
+        response = get_or_render(key, render, 60)
+        self.assertEqual(response.content.decode(), 'новая страница')
+        self.assertEqual(calls, [1])
+        self.assertIsNone(cache.get(f'{key}:lock'))
+
     def test_uploading_nonimage(self):
         """Проверка на тип загружаемого в качестве картинки объекта"""
         cache.clear()
@@ -234,3 +317,902 @@ class TestStringMethods(TestCase):
         self.assertEqual(Comment.objects.count(), 1)
         self.assertEqual(Comment.objects.first().text,
                          'комментарий авторизованного пользователя')
+
+    def test_feed_queries_do_not_depend_on_posts(self):
+        """Проверка, что число запросов ленты не растет с числом постов"""
+        for number in range(2):
+            post = Post.objects.create(text=f'пост {number}',
+                                       author=self.user,
+                                       group=self.group)
+            Comment.objects.create(text='комментарий', post=post,
+                                   author=self.user2)
+        urls = self.get_the_urls(user=self.user, post=post, group=self.group)
+        queries = {}
+        for url in urls:
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                self.client_unauth.get(url)
+            queries[url] = len(context)
+
+        for number in range(8):
+            post = Post.objects.create(text=f'еще пост {number}',
+                                       author=self.user,
+                                       group=self.group)
+            Comment.objects.create(text='комментарий', post=post,
+                                   author=self.user2)
+        for url in urls:
+            cache.clear()
+            with self.assertNumQueries(queries[url]):
+                self.client_unauth.get(url)
+
+        response = self.client_unauth.get(reverse('index'))
+        self.assertContains(response, '1 комментариев')
+
+    @override_settings(POSTS_PAGINATION='cursor')
+    def test_cursor_pagination(self):
+        """Проверка постраничного вывода по курсору"""
+        posts = [Post.objects.create(text=f'пост номер {number}',
+                                     author=self.user)
+                 for number in range(25)]
+        expected = [post.id for post in reversed(posts)]
+
+        seen = []
+        pages = []
+        cursor = None
+        for _ in range(3):
+            cache.clear()
+            url = reverse('profile', kwargs={'username': self.user.username})
+            response = self.client.get(url, {'cursor': cursor or ''})
+            page = response.context['page']
+            self.assertNotIn('?page=', response.content.decode())
+            seen.extend(post.id for post in page)
+            pages.append(page)
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertIsNone(cursor)
+
+        response = self.client.get(
+            url, {'cursor': pages[-1].previous_cursor})
+        self.assertEqual([post.id for post in response.context['page']],
+                         expected[10:20])
+        # испорченный курсор — первая страница, а не ошибка
+        for cursor in ('не-курсор', make_cursor('n', ['вчера', 'x']),
+                       make_cursor('n', [None, None])):
+            response = self.client.get(url, {'cursor': cursor})
+            self.assertEqual([post.id for post in response.context['page']],
+                             expected[:10])
+
+    def test_group_page_shows_only_group_posts(self):
+        """Проверка, что лента группы читает только посты группы"""
+        other_group = Group.objects.create(title='Запад', slug='west')
+        for number in range(3):
+            Post.objects.create(text=f'пост группы {number}',
+                                author=self.user, group=self.group)
+        for number in range(15):
+            Post.objects.create(text=f'чужой пост {number}',
+                                author=self.user, group=other_group)
+        Post.objects.create(text='пост без группы', author=self.user)
+
+        url = reverse('group', kwargs={'slug': self.group.slug})
+        # группа, число постов группы и сама страница
+        with self.assertNumQueries(3):
+            response = self.client_unauth.get(url)
+        self.assertEqual(response.context['paginator'].count, 3)
+        self.assertEqual(
+            {post.group for post in response.context['page']}, {self.group}
+        )
+        self.assertNotContains(response, 'чужой пост')
+
+    def test_counters(self):
+        """Проверка счетчиков постов, комментариев и подписок"""
+        post = Post.objects.create(text='пост', author=self.user)
+        Post.objects.create(text='еще пост', author=self.user)
+        Comment.objects.create(text='комментарий', post=post,
+                               author=self.user2)
+        self.client_auth.get(reverse('profile_follow',
+                                     kwargs={'username': self.user2}))
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(
+            (self.user.stats.posts_count, self.user.stats.following_count),
+            (2, 1)
+        )
+        self.assertEqual(self.user2.stats.followers_count, 1)
+
+        urls = [reverse('profile', kwargs={'username': self.user.username}),
+                reverse('post', kwargs={'username': self.user.username,
+                                        'post_id': post.id})]
+        for url in urls:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client_auth.get(url)
+            self.assertContains(response, 'Записей: 2')
+            self.assertFalse(
+                [query for query in context if 'COUNT(' in query['sql']],
+                f'На странице {url} не должно быть COUNT-запросов'
+            )
+
+        self.client_auth.get(reverse('profile_unfollow',
+                                     kwargs={'username': self.user2}))
+        Comment.objects.all().delete()
+        self.user2.stats.refresh_from_db()
+        self.assertEqual(self.user2.stats.followers_count, 0)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+
+    def test_rebuild_counters(self):
+        """Проверка пересчета разошедшихся счетчиков"""
+        post = Post.objects.create(text='пост', author=self.user)
+        Comment.objects.create(text='комментарий', post=post,
+                               author=self.user2)
+        Post.objects.update(comment_count=5)
+        UserStats.objects.filter(user=self.user).update(posts_count=7)
+        UserStats.objects.filter(user=self.user2).delete()
+
+        output = io.StringIO()
+        call_command('rebuild_counters', stdout=output)
+        self.assertIn('постов — 1, пользователей — 1', output.getvalue())
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.user).posts_count, 1)
+        self.assertTrue(UserStats.objects.filter(user=self.user2).exists())
+
+    @override_settings(FOLLOW_TIMELINE=True)
+    def test_follow_timeline(self):
+        """Проверка ленты подписок, разложенной по читателям"""
+        old_post = Post.objects.create(text='старый пост', author=self.user2)
+        self.client_auth.get(reverse('profile_follow',
+                                     kwargs={'username': self.user2}))
+        new_post = Post.objects.create(text='новый пост', author=self.user2)
+        Post.objects.create(text='свой пост', author=self.user)
+        self.assertEqual(
+            list(self.user.timeline.values_list('post', flat=True)),
+            [new_post.id, old_post.id]
+        )
+
+        response = self.client_auth.get(reverse('follow_index'))
+        self.assertEqual(list(response.context['page']), [new_post, old_post])
+
+        with override_settings(TIMELINE_FANOUT_LIMIT=0):
+            fanned_in = Post.objects.create(text='пост знаменитости',
+                                            author=self.user2)
+            response = self.client_auth.get(reverse('follow_index'))
+        self.assertFalse(self.user.timeline.filter(post=fanned_in).exists())
+        self.assertEqual(list(response.context['page']),
+                         [fanned_in, new_post, old_post])
+
+        self.client_auth.get(reverse('profile_unfollow',
+                                     kwargs={'username': self.user2}))
+        self.assertFalse(self.user.timeline.exists())
+
+    @override_settings(FOLLOW_TIMELINE=True, TIMELINE_MAX_ENTRIES=2)
+    def test_timelines_command(self):
+        """Проверка обрезки и пересборки лент подписок"""
+        Follow.objects.create(user=self.user, author=self.user2)
+        posts = [Post.objects.create(text=f'пост {number}', author=self.user2)
+                 for number in range(4)]
+        # лишнее обрезается уже при раскладке
+        self.assertEqual(
+            list(self.user.timeline.values_list('post', flat=True)),
+            [posts[3].id, posts[2].id]
+        )
+
+        with override_settings(TIMELINE_MAX_ENTRIES=1):
+            call_command('timelines', stdout=io.StringIO())
+        self.assertEqual(
+            list(self.user.timeline.values_list('post', flat=True)),
+            [posts[3].id]
+        )
+        self.user.timeline.all().delete()
+        call_command('timelines', '--rebuild', stdout=io.StringIO())
+        self.assertEqual(self.user.timeline.count(), 2)
+
+    def test_pregenerated_thumbnails(self):
+        """Проверка миниатюр, подготовленных заранее"""
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                first = Post.objects.create(
+                    text='пост с картинкой', author=self.user,
+                    image=ImageFile(self.create_image()))
+                second = Post.objects.create(
+                    text='еще пост с картинкой', author=self.user,
+                    image=ImageFile(self.create_image()))
+
+                response = self.client.get(reverse('index'))
+                self.assertNotContains(response, '<img')
+                self.assertContains(response, 'card-img bg-light', count=2)
+                # отсутствие миниатюр тоже в кэше, хранилище не спрашиваем
+                with self.assertNumQueries(0):
+                    self.assertEqual(thumbnails.ready_thumbnails(first.image),
+                                     {})
+
+                with override_settings(THUMBNAIL_WORKERS=0):
+                    thumbnails.generate(first.image.name)
+                results = list(
+                    thumbnails.generate_many([second.image.name], workers=1)
+                )
+                self.assertEqual(results, [(second.image.name, None)])
+
+                response = self.client.get(reverse('index'))
+                self.assertContains(response, '<img', count=2)
+                self.assertContains(response, '1920w')
+                self.assertNotContains(response, 'card-img bg-light')
+
+    def test_search(self):
+        """Проверка полнотекстового поиска по постам и комментариям"""
+        first = Post.objects.create(text='Малкольм Такер ругается',
+                                    author=self.user)
+        second = Post.objects.create(text='Совещание в министерстве',
+                                     author=self.user2)
+        comment = Comment.objects.create(text='Такер опять кричит',
+                                         post=second, author=self.user)
+        Post.objects.create(text='Про другое', author=self.user)
+
+        url = reverse('search')
+        response = self.client.get(url, {'q': 'такер'})
+        self.assertEqual(list(response.context['page']), [first, second])
+        response = self.client.get(url, {'q': '"министерств*('})
+        self.assertEqual(list(response.context['page']), [second])
+
+        comment.delete()
+        first.text = 'Малкольм молчит'
+        first.save()
+        response = self.client.get(url, {'q': 'такер'})
+        self.assertEqual(response.context['paginator'].count, 0)
+        self.assertEqual(len(self.client.get(url).context['page']), 0)
+
+    def test_post_card_cache(self):
+        """Проверка кэша карточек постов и ссылки на редактирование"""
+        post = Post.objects.create(text='старый текст', author=self.user,
+                                   group=self.group)
+        edit_url = reverse('post_edit', args=[self.user.username, post.id])
+        group_url = reverse('group', args=[self.group.slug])
+        response = self.client_auth.get(group_url)
+        self.assertContains(response, edit_url)
+        self.assertIsNotNone(
+            cache.get(cards.card_key(Post.objects.get(pk=post.pk)))
+        )
+        response = self.followee.get(group_url)
+        self.assertContains(response, 'старый текст')
+        self.assertNotContains(response, edit_url)
+
+        post.text = 'новый текст'
+        post.save()
+        Comment.objects.create(text='комментарий', post=post,
+                               author=self.user2)
+        response = self.followee.get(group_url)
+        self.assertContains(response, 'новый текст')
+        self.assertContains(response, '1 комментариев')
+
+        self.group.title = 'Юг'
+        self.group.save()
+        self.assertContains(self.followee.get(group_url), '#Юг')
+
+    def test_conditional_get(self):
+        """Проверка ответа 304, пока страница не изменилась"""
+        post = Post.objects.create(text='пост', author=self.user,
+                                   group=self.group)
+        profile_url = reverse('profile', args=[self.user.username])
+        post_url = reverse('post', args=[self.user.username, post.id])
+        for url in self.get_the_urls(self.user, post, self.group):
+            etag = self.client_unauth.get(url)['ETag']
+            # страницы с карточкой автора читают его счетчики,
+            # остальные — только кэш
+            with self.assertNumQueries(1 if url in (profile_url, post_url)
+                                       else 0):
+                response = self.client_unauth.get(url,
+                                                  HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client_auth.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+        etag = self.client_unauth.get(post_url)['ETag']
+        Comment.objects.create(text='комментарий', post=post,
+                               author=self.user2)
+        response = self.client_unauth.get(post_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        index_url = reverse('index')
+        last_modified = self.client_unauth.get(index_url)['Last-Modified']
+        response = self.client_unauth.get(
+            index_url, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # подписка меняет счетчики в карточке автора
+        etags = {url: self.client_unauth.get(url)['ETag']
+                 for url in (profile_url, post_url)}
+        Follow.objects.create(user=self.user2, author=self.user)
+        for url, etag in etags.items():
+            response = self.client_unauth.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_authenticated_feed_cache(self):
+        """Проверка кэша лент для авторизованных читателей"""
+        Follow.objects.create(user=self.user, author=self.user2)
+        post = Post.objects.create(text='первый пост', author=self.user2)
+        follow_url = reverse('follow_index')
+        self.assertContains(self.client_auth.get(follow_url), 'первый пост')
+        self.client_auth.get(reverse('index'))
+        # сессия, пользователь и посты страницы по первичному ключу
+        with self.assertNumQueries(3):
+            self.client_auth.get(follow_url)
+        with self.assertNumQueries(3):
+            response = self.followee.get(reverse('index'))
+        self.assertContains(response, 'первый пост')
+
+        version = get_follow_version(self.user.pk)
+        Post.objects.create(text='чужой пост', author=self.user)
+        self.assertEqual(get_follow_version(self.user.pk), version)
+        Comment.objects.create(text='комментарий', post=post,
+                               author=self.user)
+        self.assertContains(self.client_auth.get(follow_url),
+                            '1 комментариев')
+
+        Post.objects.create(text='второй пост', author=self.user2)
+        self.assertContains(self.client_auth.get(follow_url), 'второй пост')
+
+    def test_export_and_import(self):
+        """Проверка выгрузки и загрузки постов потоком"""
+        Follow.objects.create(user=self.user, author=self.user2)
+        post = Post.objects.create(text='архивный пост', author=self.user2,
+                                   group=self.group)
+        Comment.objects.create(text='архивный комментарий', post=post,
+                               author=self.user)
+        with tempfile.TemporaryDirectory() as directory:
+            archive = os.path.join(directory, 'archive.ndjson')
+            groups = os.path.join(directory, 'groups.csv')
+            call_command('export_posts', '-o', archive, '--chunk-size', '1',
+                         stderr=io.StringIO())
+            call_command('export_posts', '-o', groups, '--model', 'group',
+                         stderr=io.StringIO())
+            Group.objects.all().delete()
+            User.objects.filter(pk=self.user2.pk).delete()
+            self.assertFalse(Post.objects.exists())
+
+            call_command('import_posts', groups, '--model', 'group',
+                         stdout=io.StringIO())
+            self.assertEqual(Group.objects.get().slug, 'east')
+            output = io.StringIO()
+            call_command('import_posts', archive, '--batch-size', '1',
+                         '--defer-indexes', stdout=output)
+            self.assertIn('post — 1, comment — 1', output.getvalue())
+
+            # повторная загрузка ничего не добавляет
+            output = io.StringIO()
+            call_command('import_posts', archive, stdout=output)
+            self.assertIn('group — 0, post — 0, comment — 0, follow — 0',
+                          output.getvalue())
+
+            # id занят другим постом: запись не пропадает молча
+            Post.objects.update(text='другой пост')
+            with self.assertRaisesMessage(CommandError, 'id'):
+                call_command('import_posts', archive, stdout=io.StringIO())
+            Post.objects.update(text='архивный пост')
+
+        post = Post.objects.get()
+        self.assertEqual(post.group.slug, 'east')
+        self.assertEqual(post.author.username, 'marco')
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(post.comments.get().author, self.user)
+        self.assertTrue(Follow.objects.filter(user=self.user,
+                                              author=post.author).exists())
+        self.assertEqual(UserStats.of(post.author).followers_count, 1)
+        response = self.client.get(reverse('search'), {'q': 'архивный'})
+        self.assertEqual(list(response.context['page']), [post])
+
+    def test_syndication_feeds(self):
+        """Проверка RSS, Atom и JSON лент"""
+        post = Post.objects.create(text='первый пост\nвторая строка',
+                                   author=self.user, group=self.group)
+        urls = [reverse('index_feed', args=['rss']),
+                reverse('group_feed', args=[self.group.slug, 'atom']),
+                reverse('author_feed', args=[self.user.username, 'json'])]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode()
+            self.assertIn('первый пост', content)
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag']
+                )
+            self.assertEqual(response.status_code, 304)
+        feed = json.loads(b''.join(self.client.get(urls[2]).streaming_content))
+        self.assertEqual(feed['items'][0]['title'], 'первый пост')
+        self.assertEqual(feed['items'][0]['tags'], ['Восток'])
+
+        Post.objects.create(text='новый пост', author=self.user)
+        content = b''.join(self.client.get(urls[0]).streaming_content)
+        self.assertLess(content.index('новый пост'.encode()),
+                        content.index('первый пост'.encode()))
+        post.delete()
+        content = b''.join(self.client.get(urls[0]).streaming_content)
+        self.assertNotIn('первый пост'.encode(), content)
+        self.assertEqual(
+            self.client.get(reverse('group_feed', args=['nope', 'rss']))
+            .status_code, 404
+        )
+
+    def test_paginated_comments(self):
+        """Проверка постраничных комментариев и подгрузки следующих"""
+        post = Post.objects.create(text='вирусный пост', author=self.user)
+        for number in range(COMMENTS_PER_PAGE + 5):
+            Comment.objects.create(text=f'комментарий {number}', post=post,
+                                   author=self.user2)
+        url = reverse('post', args=[self.user.username, post.id])
+        # счетчики автора для ETag, пост и страница комментариев
+        with self.assertNumQueries(3):
+            response = self.client_unauth.get(url)
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COMMENTS_PER_PAGE)
+        self.assertEqual(comments[0].text,
+                         f'комментарий {COMMENTS_PER_PAGE + 4}')
+        self.assertContains(response, 'Показать еще')
+
+        fragment = self.client_unauth.get(
+            reverse('post_comments', args=[self.user.username, post.id]),
+            {'cursor': comments.next_cursor},
+        )
+        self.assertTemplateNotUsed(fragment, 'includes/post_card.html')
+        self.assertContains(fragment, 'комментарий 0')
+        self.assertNotContains(fragment, 'Показать еще')
+        self.assertEqual(len(fragment.context['comments']), 5)
+        self.assertEqual(self.client_unauth.get(
+            reverse('post_comments', args=[self.user2.username, post.id])
+        ).status_code, 404)
+
+        newest = f'комментарий {COMMENTS_PER_PAGE + 4}'
+        for name in ('post', 'post_comments'):
+            for cursor in (make_cursor('n', ['вчера', 'x']),
+                           make_cursor('n', [None, None])):
+                with self.subTest(route=name, cursor=cursor):
+                    response = self.client_unauth.get(
+                        reverse(name, args=[self.user.username, post.id]),
+                        {'cursor': cursor},
+                    )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.context['comments'][0].text,
+                                     newest)
+
+    def test_json_api(self):
+        """Проверка JSON API: поля, курсор, кэш и подписки"""
+        posts = [Post.objects.create(text=f'пост {number}', author=self.user,
+                                     group=self.group)
+                 for number in range(3)]
+        post = posts[-1]
+        Comment.objects.create(text='комментарий', post=post,
+                               author=self.user2)
+        url = reverse('api_posts')
+        with self.assertNumQueries(1):
+            response = self.client_unauth.get(
+                url, {'fields': 'id,author,group', 'limit': 2}
+            )
+        data = response.json()
+        self.assertEqual(data['results'][0], {
+            'id': post.id,
+            'author': {'id': self.user.id, 'username': 'peter'},
+            'group': {'id': self.group.id, 'slug': 'east',
+                      'title': 'Восток'},
+        })
+        self.assertEqual(len(data['results']), 2)
+        with self.assertNumQueries(0):
+            self.client_unauth.get(url, {'fields': 'id,author,group',
+                                         'limit': 2})
+        data = self.client_unauth.get(data['next']).json()
+        self.assertEqual(data['results'][0]['id'], posts[0].id)
+        self.assertIsNone(data['next'])
+        self.assertEqual(
+            self.client_unauth.get(url, {'fields': 'id,password'})
+            .status_code, 400
+        )
+        for cursor in (make_cursor('n', ['вчера', 'x']),
+                       make_cursor('n', [None, None])):
+            with self.subTest(cursor=cursor):
+                response = self.client_unauth.get(url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['results'][0]['id'],
+                                 post.id)
+        self.assertEqual(resolve(url).func.__name__, 'post_list')
+
+        comments = self.client_unauth.get(
+            reverse('api_post_comments', args=[post.id])
+        ).json()
+        self.assertEqual(comments['results'][0]['author']['username'],
+                         'marco')
+        user = self.client_unauth.get(
+            reverse('api_user', args=['peter'])
+        ).json()
+        self.assertEqual(user['posts_count'], 3)
+
+        follow_url = reverse('api_follow')
+        self.assertEqual(self.client_unauth.get(follow_url).status_code, 401)
+        self.assertEqual(self.followee.get(follow_url).json()['results'], [])
+        Follow.objects.create(user=self.user2, author=self.user)
+        self.assertEqual(
+            len(self.followee.get(follow_url).json()['results']), 3
+        )
+
+    @override_settings(TEMPLATE_PROFILING=True)
+    def test_template_profiler(self):
+        """Проверка времени отрисовки шаблонов в Server-Timing"""
+        for number in range(3):
+            Post.objects.create(text=f'пост {number}', author=self.user)
+        response = Client().get(reverse('index'))
+        timing = response['Server-Timing']
+        self.assertIn('desc="includes/post_card.html x3"', timing)
+        self.assertIn('desc="index.html x1"', timing)
+
+    def test_metrics(self):
+        """Проверка метрик запросов по имени адреса"""
+        def sample(text, name, labels):
+            prefix = f'{name}{{{labels}}} '
+            for line in text.splitlines():
+                if line.startswith(prefix):
+                    return float(line[len(prefix):])
+            return 0
+
+        prometheus = Client(HTTP_AUTHORIZATION='Bearer секрет')
+        with self.settings(METRICS_TOKEN='секрет'):
+            before = prometheus.get(reverse('metrics')).content.decode()
+            self.client_unauth.get(reverse('index'))
+            self.client_unauth.get(reverse('index'))
+            text = prometheus.get(reverse('metrics')).content.decode()
+        for name, labels, grown in (
+                ('yatube_requests_total', 'view="index",status="200"', 2),
+                ('yatube_request_duration_seconds_count', 'view="index"', 2),
+                ('yatube_cache_hits_total', 'view="index"', 1)):
+            self.assertGreaterEqual(
+                sample(text, name, labels) - sample(before, name, labels),
+                grown, name,
+            )
+        self.assertGreater(sample(text, 'yatube_db_queries_total',
+                                  'view="index"'), 0)
+        self.assertGreater(sample(text, 'yatube_template_render_seconds_total',
+                                  'view="index"'), 0)
+        self.assertIn('# TYPE yatube_request_duration_seconds histogram',
+                      text)
+        # запрос через локальный прокси без токена
+        self.assertEqual(self.client_unauth.get(reverse('metrics'))
+                         .status_code, 404)
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(
+                Client(REMOTE_ADDR='10.0.0.1').get(reverse('metrics'))
+                .status_code, 200
+            )
+
+        # get_many у LocMemCache зовет get: каждый ключ считается один раз
+        local = LocMemCache('metrics-test', {})
+        local.set('есть', 1)
+        metrics._instrument_cache(local)
+        request_metrics = metrics.RequestMetrics()
+        token = metrics._current.set(request_metrics)
+        try:
+            local.get_many(['есть', 'нет'])
+        finally:
+            metrics._current.reset(token)
+        self.assertEqual((request_metrics.cache_hits,
+                          request_metrics.cache_misses), (1, 1))
+        self.assertIs(LocMemCache.get_many, BaseCache.get_many)
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_slow_query_log(self):
+        """Проверка журнала медленных запросов с планом выполнения"""
+        self.assertEqual(
+            slow_queries.fingerprint(
+                "SELECT * FROM t WHERE id IN (%s, %s) AND a = 'x' LIMIT 21"
+            ),
+            'SELECT * FROM t WHERE id IN (...) AND a = ? LIMIT ?',
+        )
+        with self.assertRaisesMessage(CommandError, 'YATUBE_CACHE=shared'):
+            call_command('slow_queries', stdout=io.StringIO())
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        location = os.path.join(directory.name, 'shared.sqlite3')
+        self.enterContext(override_settings(CACHES={
+            'default': settings.CACHES['default'],
+            'shared': {'BACKEND': 'yatube.cache_backends.SQLiteCache',
+                       'LOCATION': location},
+        }))
+        Post.objects.create(text='пост', author=self.user)
+        for _ in range(2):
+            self.client_auth.get(reverse('index'))
+        # журнал виден другому процессу, который откроет тот же файл
+        self.assertEqual(SQLiteCache(location, {}).get(slow_queries.CACHE_KEY),
+                         slow_queries.shapes())
+        shapes = slow_queries.shapes()
+        by_view = [shape for shape in shapes.values()
+                   if shape['view'] == 'posts.views.index']
+        self.assertTrue(by_view)
+        self.assertTrue(all(shape['plan'] for shape in by_view))
+
+        out = io.StringIO()
+        call_command('slow_queries', '--limit', '1', '--sort', 'count',
+                     stdout=out)
+        self.assertIn('план:', out.getvalue())
+
+    def test_flatpages_cache(self):
+        """Проверка кэша flatpages и заранее отрисованных страниц"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(
+            FLATPAGES_PRERENDER_DIR=directory.name
+        ))
+        page = FlatPage.objects.create(url='/about-us/', title='О нас',
+                                       content='Первая версия')
+        page.sites.add(settings.SITE_ID)
+        url = reverse('about')
+        self.assertContains(self.client_unauth.get(url), 'Первая версия')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client_unauth.get(url),
+                                'Первая версия')
+        with self.assertNumQueries(2):
+            response = self.client_auth.get(url)
+        self.assertContains(response, 'Пользователь: peter')
+
+        page.content = 'Вторая версия'
+        page.save()
+        self.assertContains(self.client_unauth.get(url), 'Вторая версия')
+
+        call_command('prerender_flatpages', stdout=io.StringIO())
+        path = flatpages.prerendered_path(page.url)
+        with open(path, 'ab') as prerendered:
+            prerendered.write(b'<!-- prerendered -->')
+        cache.clear()
+        # шаблоны не нужны, только сверка с самой страницей
+        with self.assertNumQueries(1):
+            response = self.client_unauth.get(url)
+        self.assertContains(response, 'Вторая версия')
+        self.assertContains(response, 'prerendered')
+
+        # устаревший файл не отдается, даже если правка прошла мимо сигналов
+        FlatPage.objects.filter(pk=page.pk).update(content='Мимо сигналов')
+        cache.clear()
+        self.assertContains(self.client_unauth.get(url), 'Мимо сигналов')
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.client_unauth.get(reverse('terms'))
+                         .status_code, 404)
+
+        other = FlatPage.objects.create(url='/contacts/', title='Контакты',
+                                        content='Пишите письма')
+        other.sites.add(settings.SITE_ID)
+        other_url = reverse('flatpage', args=['contacts/'])
+        self.assertContains(self.client_unauth.get(other_url), 'Пишите')
+        with self.assertNumQueries(0):
+            self.client_unauth.get(other_url)
+
+    def test_query_budgets(self):
+        """Проверка потолков числа запросов для каждого адреса"""
+        Follow.objects.create(user=self.user, author=self.user2)
+        for number in range(12):
+            post = Post.objects.create(text=f'пост {number}',
+                                       author=self.user, group=self.group)
+            Post.objects.create(text=f'чужой пост {number}',
+                                author=self.user2, group=self.group)
+            Comment.objects.create(text='комментарий', post=post,
+                                   author=self.user2)
+        routes = route_requests(self.user, post, self.group)
+        for name, (method, url, data) in routes.items():
+            with self.subTest(route=name):
+                response, queries = count_queries(self.client_auth, method,
+                                                  url, data)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(queries, QUERY_BUDGETS[name])
+
+
+class TestCacheBackends(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, 'cache.sqlite3')
+
+    def test_sqlite_cache(self):
+        """Проверка общего кэша в файле SQLite"""
+        shared = SQLiteCache(self.location, {})
+        other_worker = SQLiteCache(self.location, {})
+        shared.set('ключ', {'страница': 1})
+        self.assertEqual(other_worker.get('ключ'), {'страница': 1})
+        self.assertFalse(other_worker.add('ключ', 'другое'))
+        shared.delete('ключ')
+        self.assertIsNone(other_worker.get('ключ'))
+
+        shared.set('просрочен', 1, timeout=-1)
+        self.assertIsNone(shared.get('просрочен'))
+        self.assertTrue(shared.add('просрочен', 2))
+        self.assertEqual(shared.get('просрочен'), 2)
+
+    def test_sqlite_cache_evicts_least_recently_used(self):
+        """Проверка вытеснения давно не читанных записей"""
+        shared = SQLiteCache(self.location,
+                             {'OPTIONS': {'MAX_ENTRIES': 10}})
+        shared.access_resolution = 0
+        for number in range(10):
+            shared.set(f'ключ {number}', number)
+        shared.get('ключ 0')
+        shared.set('новый', 'значение')
+        self.assertEqual(shared.get('ключ 0'), 0)
+        self.assertIsNone(shared.get('ключ 1'))
+        self.assertEqual(shared.get('новый'), 'значение')
+
+    def test_sqlite_cache_stats_on_overwrite(self):
+        """Перезапись ключа не должна раздувать счетчики кэша"""
+        shared = SQLiteCache(self.location,
+                             {'OPTIONS': {'MAX_ENTRIES': 10}})
+        for number in range(25):
+            shared.set('ключ', 'значение' * number)
+        connection = shared._connection()
+
+        def stats():
+            return (connection.execute('SELECT entries, size '
+                                       'FROM cache_stats').fetchone(),
+                    connection.execute('SELECT COUNT(*), SUM(size) '
+                                       'FROM cache').fetchone())
+
+        recorded, actual = stats()
+        self.assertEqual(recorded, actual)
+        self.assertEqual(actual[0], 1)
+
+        # счетчики, испорченные старой версией, сверяются при вытеснении
+        connection.execute('UPDATE cache_stats SET entries = 1000')
+        shared.set('другой', 'значение')
+        recorded, actual = stats()
+        self.assertEqual(recorded, actual)
+        self.assertEqual(actual[0], 2)
+
+    def test_tiered_cache(self):
+        """Проверка LRU процесса перед общим кэшем"""
+        shared_settings = {
+            'BACKEND': 'yatube.cache_backends.SQLiteCache',
+            'LOCATION': self.location,
+        }
+        with self.settings(CACHES={'default': shared_settings,
+                                   'shared': shared_settings}):
+            tiered = TieredCache('', {'OPTIONS': {
+                'LOCAL_MAX_ENTRIES': 1,
+                'LOCAL_KEY_PREFIXES': ['горячий:'],
+            }})
+            tiered.set('горячий:1', 'первая страница')
+            tiered.set('холодный', 'значение')
+            caches['shared'].set('горячий:1', 'изменено в другом процессе')
+            caches['shared'].set('холодный', 'изменено в другом процессе')
+            self.assertEqual(tiered.get('горячий:1'), 'первая страница')
+            self.assertEqual(tiered.get('холодный'),
+                             'изменено в другом процессе')
+
+            tiered.set('горячий:2', 'вторая страница')
+            self.assertEqual(tiered.get('горячий:1'),
+                             'изменено в другом процессе')
+
+
+@override_settings(WRITE_BATCHING=True, WRITE_BATCH_WINDOW=0.2)
+class TestWriteBatching(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='peter')
+        self.post = Post.objects.create(text='горячий пост', author=self.user)
+        write_batch.history.clear()
+
+    def test_comments_committed_in_one_batch(self):
+        """Проверка, что одновременные комментарии пишутся одной пачкой"""
+        def comment(number):
+            write_batch.save(Comment(text=f'комментарий {number}',
+                                     post=self.post, author=self.user))
+
+        threads = [threading.Thread(target=comment, args=[number])
+                   for number in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.post.comments.count(), 5)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 5)
+        self.assertEqual(write_batch.metrics()['rows'], 5)
+        self.assertLess(write_batch.metrics()['batches'], 5)
+
+    def test_failed_row_does_not_abort_batch(self):
+        """Проверка, что ошибка одной записи не откатывает остальные"""
+        good = Comment(text='хороший', post=self.post, author=self.user)
+        broken = Comment(text='без поста', post_id=10 ** 6,
+                         author=self.user)
+        batch = [(good, Future(), time.monotonic()),
+                 (broken, Future(), time.monotonic())]
+        stats = write_batch.write(batch)
+        self.assertEqual((stats.size, stats.failed), (2, 1))
+        self.assertIsNone(batch[0][1].result())
+        with self.assertRaises(IntegrityError):
+            batch[1][1].result()
+        self.assertTrue(Comment.objects.filter(pk=good.pk).exists())
+
+    @override_settings(METRICS_TOKEN='секрет')
+    def test_batch_metrics_exported(self):
+        """Проверка счетчиков пачек на странице /metrics"""
+        before = write_batch.totals()
+        write_batch.write([
+            (Comment(text='хороший', post=self.post, author=self.user),
+             Future(), time.monotonic()),
+            (Comment(text='без поста', post_id=10 ** 6, author=self.user),
+             Future(), time.monotonic()),
+        ])
+        text = Client(HTTP_AUTHORIZATION='Bearer секрет').get(
+            reverse('metrics')
+        ).content.decode()
+        samples = dict(line.rsplit(' ', 1) for line in text.splitlines()
+                       if line.startswith('yatube_write_batch'))
+        self.assertEqual(int(samples['yatube_write_batch_size_count']),
+                         before['batches'] + 1)
+        self.assertEqual(int(samples['yatube_write_batch_size_sum']),
+                         before['rows'] + 2)
+        self.assertEqual(
+            int(samples['yatube_write_batch_failures_total']),
+            before['failed'] + 1,
+        )
+        for name in ('yatube_write_batch_wait_seconds_total',
+                     'yatube_write_batch_commit_seconds_total'):
+            self.assertGreater(float(samples[name]), 0)
+
+    @override_settings(WRITE_BATCHING=True)
+    def test_worker_survives_failed_batch(self):
+        """Проверка, что упавшая пачка не вешает следующие запросы"""
+        write = write_batch.write
+
+        def broken_write(batch):
+            raise RuntimeError('диск отвалился')
+
+        write_batch.write = broken_write
+        try:
+            with self.assertRaisesMessage(RuntimeError, 'диск отвалился'):
+                write_batch.save(Comment(text='первый', post=self.post,
+                                         author=self.user))
+        finally:
+            write_batch.write = write
+        write_batch.save(Comment(text='второй', post=self.post,
+                                 author=self.user))
+        self.assertEqual(
+            list(self.post.comments.values_list('text', flat=True)),
+            ['второй']
+        )
+
+    @override_settings(WRITE_BATCHING=True, WRITE_BATCH_TIMEOUT=0.05)
+    def test_request_saves_itself_when_worker_is_stuck(self):
+        """Проверка, что запрос не ждет зависшую пачку вечно"""
+        write_batch._ensure_worker()
+        queue, ensure_worker = write_batch._queue, write_batch._ensure_worker
+        # очередь, которую никто не читает: поток пачек будто завис
+        write_batch._queue = type(queue)()
+        write_batch._ensure_worker = lambda: None
+        try:
+            comment = write_batch.save(Comment(
+                text='сам по себе', post=self.post, author=self.user
+            ))
+            (_, future, _), = write_batch._queue.queue
+        finally:
+            write_batch._queue = queue
+            write_batch._ensure_worker = ensure_worker
+        self.assertTrue(Comment.objects.filter(pk=comment.pk).exists())
+        self.assertTrue(future.cancelled())
+        # отмененный объект пачка второй раз не пишет
+        self.assertIsNone(write_batch.write([(comment, future, 0)]))
+
+
+class TestDatabaseRouting(SimpleTestCase):
+    databases = {'default'}
+
+    def test_sqlite_pragmas(self):
+        """Проверка PRAGMA новых соединений"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64 * 1024)
+
+    def test_read_only_views_use_read_connection(self):
+        """Проверка, что чтение в read_only идет в базу для чтения"""
+        router = ReadWriteRouter()
+        databases = dict(settings.DATABASES, read={})
+        with override_settings(DATABASES=databases):
+            self.assertEqual(router.db_for_read(Post), 'default')
+            with reading():
+                self.assertEqual(router.db_for_read(Post), 'read')
+                self.assertEqual(router.db_for_write(Post), 'default')
+                with transaction.atomic():
+                    self.assertEqual(router.db_for_read(Post), 'default')
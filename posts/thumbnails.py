@@ -0,0 +1,205 @@
+"""Миниатюры картинок постов, которые готовятся заранее в пуле процессов.
+
+Запрос страницы никогда не декодирует оригинал: шаблон берет только уже
+готовые миниатюры из key-value хранилища sorl-thumbnail, а пока их нет,
+показывает заглушку. Миниатюры готовит пул процессов сразу после
+сохранения поста. Ответ хранилища, в том числе "миниатюр еще нет", лежит
+в кэше, чтобы карточка с заглушкой не ходила в базу на каждой ленте.
+"""
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from .cache import invalidate_feeds
+
+logger = logging.getLogger(__name__)
+
+# имя миниатюры: размер и параметры sorl-thumbnail
+RENDITIONS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+    'small': ('480x170', {'crop': 'center', 'upscale': True}),
+    'retina': ('1920x678', {'crop': 'center', 'upscale': True}),
+}
+
+# сколько помнить, что миниатюр нет: пул мог упасть и не сообщить
+MISSING_TIMEOUT = 60
+
+_executor = None
+
+
+class PregeneratedBackend(ThumbnailBackend):
+    def full_options(self, source, options):
+        """Параметры миниатюры так же, как их дополняет get_thumbnail"""
+        options = dict(options)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_file(self, source, geometry, options):
+        name = self._get_thumbnail_filename(
+            source, geometry, self.full_options(source, options)
+        )
+        return ImageFile(name, default.storage)
+
+    def ready(self, file_, geometry, options):
+        """Готовая миниатюра или None; сама картинка не открывается"""
+        source = ImageFile(file_)
+        return default.kvstore.get(
+            self.thumbnail_file(source, geometry, options)
+        )
+
+    def render(self, name, renditions):
+        """Пишет файлы миниатюр, декодируя оригинал один раз"""
+        source = ImageFile(name)
+        source_image = default.engine.get_image(source)
+        try:
+            source.set_size(default.engine.get_image_size(source_image))
+            image_info = default.engine.get_image_info(source_image)
+            for geometry, options in renditions:
+                thumbnail = self.thumbnail_file(source, geometry, options)
+                if thumbnail.exists():
+                    continue
+                options = self.full_options(source, options)
+                options['image_info'] = image_info
+                self._create_thumbnail(source_image, geometry, options,
+                                       thumbnail)
+        finally:
+            default.engine.cleanup(source_image)
+
+
+backend = PregeneratedBackend()
+
+
+def _ready_key(name):
+    return f'thumbnails:{hashlib.md5(name.encode()).hexdigest()}'
+
+
+def ready_thumbnails(image):
+    """Готовые миниатюры картинки по именам из RENDITIONS"""
+    if not image:
+        return {}
+    key = _ready_key(image.name)
+    thumbnails = cache.get(key)
+    if thumbnails is not None:
+        return thumbnails
+    thumbnails = {}
+    for rendition, (geometry, options) in RENDITIONS.items():
+        thumbnail = backend.ready(image, geometry, options)
+        if thumbnail is not None:
+            thumbnails[rendition] = thumbnail
+    complete = len(thumbnails) == len(RENDITIONS)
+    cache.set(key, thumbnails,
+              settings.FEED_CACHE_TIMEOUT if complete else MISSING_TIMEOUT)
+    return thumbnails
+
+
+def forget(name):
+    """Сбрасывает закэшированный ответ хранилища о миниатюрах картинки"""
+    cache.delete(_ready_key(name))
+
+
+def _init_worker():
+    if not django.apps.apps.ready:
+        django.setup()
+    # соединения с базой, унаследованные через fork, использовать нельзя
+    for connection in connections.all():
+        connection.connection = None
+
+
+def _render(name):
+    backend.render(name, RENDITIONS.values())
+    return name
+
+
+def _register(name):
+    """Записывает готовые файлы в хранилище sorl-thumbnail"""
+    for geometry, options in RENDITIONS.values():
+        get_thumbnail(name, geometry, **options)
+    return name
+
+
+def _render_and_register(name):
+    return _register(_render(name))
+
+
+def _on_done(future):
+    try:
+        name = future.result()
+    except Exception:
+        logger.exception('Не удалось подготовить миниатюры')
+    else:
+        # закэшированные страницы еще показывают заглушку
+        forget(name)
+        invalidate_feeds()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS, initializer=_init_worker
+        )
+    return _executor
+
+
+def generate(name):
+    """Готовит миниатюры в пуле процессов или сразу, если пул выключен"""
+    global _executor
+    try:
+        if not settings.THUMBNAIL_WORKERS:
+            _render_and_register(name)
+            forget(name)
+            invalidate_feeds()
+            return
+        _get_executor().submit(_render_and_register, name).add_done_callback(
+            _on_done
+        )
+    except Exception:
+        # упавший пул пересоздадим при следующей картинке
+        _executor = None
+        logger.exception('Не удалось подготовить миниатюры %s', name)
+
+
+def _safe_render(name):
+    try:
+        return _render(name), None
+    except Exception as error:
+        return name, error
+
+
+def generate_many(names, workers=None):
+    """Готовит миниатюры для многих картинок, отдает (имя, ошибка)"""
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker) as pool:
+        for name, error in pool.map(_safe_render, names, chunksize=16):
+            if error is None:
+                try:
+                    _register(name)
+                except Exception as register_error:
+                    error = register_error
+                forget(name)
+            yield name, error
+    invalidate_feeds()
+
+
+def schedule(post):
+    """Готовит миниатюры картинки поста после фиксации транзакции"""
+    if post.image:
+        name = post.image.name
+        transaction.on_commit(lambda: generate(name))
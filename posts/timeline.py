@@ -0,0 +1,152 @@
+"""Лента подписок, раскладываемая по читателям при публикации.
+
+Новый пост сразу записывается в TimelineEntry каждого подписчика, и лента
+читается диапазоном по индексу (user, pub_date). Посты авторов, у которых
+подписчиков больше TIMELINE_FANOUT_LIMIT, не раскладываются: их лента
+подмешивает при чтении. Длина каждой ленты ограничена TIMELINE_MAX_ENTRIES:
+лишние старые записи удаляются при раскладке.
+"""
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import Follow, Post, TimelineEntry, UserStats
+
+BATCH_SIZE = 500
+
+
+def is_enabled():
+    return getattr(settings, 'FOLLOW_TIMELINE', False)
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_LIMIT', 10000)
+
+
+def max_entries():
+    return getattr(settings, 'TIMELINE_MAX_ENTRIES', 1000)
+
+
+def is_fanned_out(author_id):
+    followers = (UserStats.objects.filter(user_id=author_id)
+                 .values_list('followers_count', flat=True).first())
+    return (followers or 0) <= fanout_limit()
+
+
+def _entries(user_id, posts):
+    return [TimelineEntry(user_id=user_id, post_id=post.id,
+                          author_id=post.author_id, pub_date=post.pub_date)
+            for post in posts]
+
+
+def _trim_users(user_ids, limit):
+    """Оставляет в лентах user_ids по limit последних записей.
+
+    Один запрос на всю пачку читателей: записи нумеруются оконной функцией
+    по индексу (user, pub_date). Возвращает число удаленных записей.
+    """
+    if not user_ids:
+        return 0
+    table = TimelineEntry._meta.db_table
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    connection = connections[router.db_for_write(TimelineEntry)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ('
+            f'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+            f'PARTITION BY user_id ORDER BY pub_date DESC, id DESC'
+            f') AS position FROM {table} WHERE user_id IN ({placeholders})'
+            f') WHERE position > %s)',
+            [*user_ids, limit],
+        )
+        return cursor.rowcount
+
+
+def _write(batch, limit):
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+    _trim_users(sorted({entry.user_id for entry in batch}), limit)
+
+
+def fan_out(post):
+    """Кладет новый пост в ленты подписчиков автора"""
+    if not is_enabled() or not is_fanned_out(post.author_id):
+        return
+    limit = max_entries()
+    followers = (Follow.objects.filter(author_id=post.author_id)
+                 .values_list('user_id', flat=True))
+    batch = []
+    for user_id in followers.iterator():
+        batch.extend(_entries(user_id, [post]))
+        if len(batch) == BATCH_SIZE:
+            _write(batch, limit)
+            batch = []
+    _write(batch, limit)
+
+
+def add_author(user_id, author_id):
+    """Заполняет ленту последними постами автора после подписки"""
+    if not is_enabled() or not is_fanned_out(author_id):
+        return
+    limit = max_entries()
+    posts = (Post.objects.filter(author_id=author_id)
+             .only('id', 'author_id', 'pub_date')[:limit])
+    TimelineEntry.objects.bulk_create(
+        _entries(user_id, posts), batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    _trim_users([user_id], limit)
+
+
+def remove_author(user_id, author_id):
+    if is_enabled():
+        TimelineEntry.objects.filter(user_id=user_id,
+                                     author_id=author_id).delete()
+
+
+def follow_feed(user):
+    """Посты ленты подписок и порядок, в котором их нужно отдавать.
+
+    Возвращает queryset и признак того, что это записи TimelineEntry, а не
+    посты: такие записи нужно превратить в посты после постраничной нарезки.
+    """
+    if not is_enabled():
+        posts = Post.objects.for_feed().filter(
+            author__following__in=Follow.objects.filter(user=user)
+        )
+        return posts, False
+
+    fanned_in = list(
+        Follow.objects.filter(
+            user=user, author__stats__followers_count__gt=fanout_limit()
+        ).values_list('author_id', flat=True)
+    )
+    if not fanned_in:
+        entries = (TimelineEntry.objects.filter(user=user)
+                   .select_related('post__author', 'post__group'))
+        return entries, True
+
+    own = TimelineEntry.objects.filter(user=user).values('post_id')
+    posts = Post.objects.for_feed().filter(
+        Q(id__in=own) | Q(author_id__in=fanned_in)
+    )
+    return posts, False
+
+
+def trim(limit=None):
+    """Обрезает ленты до TIMELINE_MAX_ENTRIES, возвращает число удаленных"""
+    limit = limit or max_entries()
+    deleted = 0
+    users = list(TimelineEntry.objects.order_by('user_id')
+                 .values_list('user_id', flat=True).distinct())
+    for start in range(0, len(users), BATCH_SIZE):
+        deleted += _trim_users(users[start:start + BATCH_SIZE], limit)
+    return deleted
+
+
+def rebuild():
+    """Собирает все ленты заново по подпискам, возвращает число записей"""
+    TimelineEntry.objects.all().delete()
+    follows = Follow.objects.order_by('user_id').iterator()
+    for follow in follows:
+        add_author(follow.user_id, follow.author_id)
+    return TimelineEntry.objects.count()
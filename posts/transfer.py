@@ -0,0 +1,272 @@
+"""Выгрузка и загрузка групп, постов, комментариев и подписок.
+
+Записи читаются и пишутся потоком, поэтому память не зависит от размера
+архива. Пользователи и группы в записях указаны по username и slug, id
+постов и комментариев сохраняются, чтобы ссылки на посты не менялись.
+Запись, id которой уже занят той же строкой, пропускается, поэтому архив
+можно загрузить повторно; занятый другой строкой id — ошибка загрузки.
+Загрузка идет через bulk_create пачками, без сигналов: счетчики, поиск и
+ленты подписок пересчитываются один раз в конце.
+"""
+from collections import Counter
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from . import search, timeline
+from .cache import invalidate_feeds, invalidate_follow_feeds
+from .counters import rebuild_counters
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# порядок важен: записи ссылаются на уже загруженные
+FIELDS = {
+    'group': ('id', 'title', 'slug', 'description'),
+    'post': ('id', 'text', 'pub_date', 'author', 'group', 'image'),
+    'comment': ('id', 'post', 'author', 'text', 'created'),
+    'follow': ('user', 'author'),
+}
+MODELS = tuple(FIELDS)
+
+# поля выгрузки в терминах values_list
+_COLUMNS = {
+    'group': (Group, ('id', 'title', 'slug', 'description')),
+    'post': (Post, ('id', 'text', 'pub_date', 'author__username',
+                    'group__slug', 'image')),
+    'comment': (Comment, ('id', 'post_id', 'author__username', 'text',
+                          'created')),
+    'follow': (Follow, ('user__username', 'author__username')),
+}
+
+
+def export_records(models=MODELS, chunk_size=2000):
+    """Записи выбранных моделей по порядку id, без загрузки всей таблицы"""
+    for name in MODELS:
+        if name not in models:
+            continue
+        model, columns = _COLUMNS[name]
+        rows = (model.objects.order_by('pk').values_list(*columns)
+                .iterator(chunk_size=chunk_size))
+        for row in rows:
+            record = {'model': name}
+            record.update(zip(FIELDS[name], row))
+            yield record
+
+
+@contextmanager
+def manual_dates(*fields):
+    """Позволяет задать даты полей с auto_now_add при наполнении базы"""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+@contextmanager
+def deferred_indexes(models=(Post, Comment, Follow)):
+    """Снимает составные индексы на время загрузки и строит их заново"""
+    # SQL берем у schema editor, но не входим в него: внутри транзакции
+    # SQLite это запрещает
+    editor = connection.schema_editor()
+    indexes = [(model, index) for model in models
+               for index in model._meta.indexes]
+    with connection.cursor() as cursor:
+        for model, index in indexes:
+            cursor.execute(str(index.remove_sql(model, editor)))
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for model, index in indexes:
+                cursor.execute(str(index.create_sql(model, editor)))
+
+
+def _empty(value):
+    return value in (None, '')
+
+
+def _date(value):
+    return value if hasattr(value, 'isoformat') else parse_datetime(value)
+
+
+def _id(value):
+    return None if _empty(value) else int(value)
+
+
+def _new_records(name, model, records, fields, key):
+    """Записи, id которых еще свободны.
+
+    fields — поля модели, key(record) — их значения в записи. Если id
+    занят строкой с другими значениями, загрузка прерывается: иначе запись
+    молча пропала бы, а ее комментарии достались бы чужому посту.
+    """
+    ids = [_id(record.get('id')) for record in records]
+    existing = {
+        row[0]: tuple(row[1:]) for row in model.objects.filter(
+            pk__in=[pk for pk in ids if pk is not None]
+        ).values_list('pk', *fields)
+    }
+    new = []
+    for pk, record in zip(ids, records):
+        if pk not in existing:
+            new.append(record)
+        elif existing[pk] != key(record):
+            raise ValueError(f'{name} с id {pk} уже есть в базе и не '
+                             f'совпадает с записью архива')
+    return new
+
+
+class Importer:
+    """Копит записи по моделям и сохраняет их пачками по batch_size"""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.buffers = {name: [] for name in MODELS}
+        self.loaded = Counter()
+
+    def add(self, record):
+        name = record.get('model')
+        if name not in self.buffers:
+            raise ValueError(f'Неизвестная модель: {name!r}')
+        self.buffers[name].append(record)
+        if len(self.buffers[name]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with transaction.atomic():
+            for name in MODELS:
+                records = self.buffers[name]
+                if records:
+                    self.loaded[name] += getattr(self, f'_load_{name}')(
+                        records
+                    )
+                    records.clear()
+
+    def finish(self):
+        """Досохраняет остаток и пересчитывает то, что обычно делают сигналы"""
+        self.flush()
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                    no_style(), [Group, Post, Comment, Follow]):
+                cursor.execute(sql)
+        rebuild_counters()
+        search.rebuild()
+        if timeline.is_enabled():
+            timeline.rebuild()
+        invalidate_feeds()
+        return self.loaded
+
+    def _user_ids(self, usernames):
+        """id пользователей по username, недостающие создаются без пароля"""
+        usernames = set(usernames)
+        ids = dict(User.objects.filter(username__in=usernames)
+                   .values_list('username', 'id'))
+        missing = usernames - set(ids)
+        if missing:
+            User.objects.bulk_create(
+                [User(username=username, password=make_password(None))
+                 for username in missing],
+                ignore_conflicts=True,
+            )
+            ids.update(User.objects.filter(username__in=missing)
+                       .values_list('username', 'id'))
+        return ids
+
+    def _group_ids(self, slugs):
+        slugs = {slug for slug in slugs if not _empty(slug)}
+        ids = dict(Group.objects.filter(slug__in=slugs)
+                   .values_list('slug', 'id'))
+        missing = slugs - set(ids)
+        if missing:
+            Group.objects.bulk_create(
+                [Group(title=slug, slug=slug) for slug in missing],
+                ignore_conflicts=True,
+            )
+            ids.update(Group.objects.filter(slug__in=missing)
+                       .values_list('slug', 'id'))
+        return ids
+
+    def _load_group(self, records):
+        records = _new_records('Группа', Group, records, ('slug',),
+                               lambda record: (record['slug'],))
+        taken = set(Group.objects.filter(
+            slug__in=[record['slug'] for record in records]
+        ).values_list('slug', flat=True))
+        # группа с тем же slug, но другим id уже есть: посты найдут ее по slug
+        records = [record for record in records
+                   if record['slug'] not in taken]
+        Group.objects.bulk_create(
+            [Group(id=_id(record.get('id')), title=record['title'],
+                   slug=record['slug'],
+                   description=record.get('description') or '')
+             for record in records]
+        )
+        return len(records)
+
+    def _load_post(self, records):
+        records = _new_records(
+            'Пост', Post, records, ('author__username', 'text'),
+            lambda record: (record['author'], record['text']),
+        )
+        users = self._user_ids(record['author'] for record in records)
+        groups = self._group_ids(record.get('group') for record in records)
+        with manual_dates(Post._meta.get_field('pub_date')):
+            Post.objects.bulk_create(
+                [Post(id=_id(record.get('id')), text=record['text'],
+                      pub_date=_date(record['pub_date']),
+                      author_id=users[record['author']],
+                      group_id=groups.get(record.get('group')),
+                      image=record.get('image') or None)
+                 for record in records]
+            )
+        invalidate_follow_feeds(
+            Follow.objects.filter(author_id__in=set(users.values()))
+            .values_list('user_id', flat=True).distinct()
+        )
+        return len(records)
+
+    def _load_comment(self, records):
+        records = _new_records(
+            'Комментарий', Comment, records,
+            ('post_id', 'author__username', 'text'),
+            lambda record: (_id(record['post']), record['author'],
+                            record['text']),
+        )
+        users = self._user_ids(record['author'] for record in records)
+        with manual_dates(Comment._meta.get_field('created')):
+            Comment.objects.bulk_create(
+                [Comment(id=_id(record.get('id')), text=record['text'],
+                         post_id=_id(record['post']),
+                         author_id=users[record['author']],
+                         created=_date(record['created']))
+                 for record in records]
+            )
+        return len(records)
+
+    def _load_follow(self, records):
+        users = self._user_ids(
+            username for record in records
+            for username in (record['user'], record['author'])
+        )
+        pairs = {(users[record['user']], users[record['author']])
+                 for record in records
+                 if record['user'] != record['author']}
+        existing = set(Follow.objects.filter(
+            user_id__in={user for user, _ in pairs},
+            author_id__in={author for _, author in pairs},
+        ).values_list('user_id', 'author_id'))
+        pairs -= existing
+        Follow.objects.bulk_create(
+            [Follow(user_id=user, author_id=author)
+             for user, author in pairs]
+        )
+        invalidate_follow_feeds({user for user, _ in pairs})
+        return len(pairs)
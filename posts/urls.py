@@ -1,17 +1,36 @@
 from django.urls import path
 
-from . import views
+from . import api, feeds, views
 
 urlpatterns = [
     path("", views.index, name="index"),
     path("group/<slug:slug>/", views.group_posts, name="group"),
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search, name="search"),
+    path("feeds/<str:fmt>/", feeds.index_feed, name="index_feed"),
+    path("feeds/group/<slug:slug>/<str:fmt>/", feeds.group_feed,
+         name="group_feed"),
+    path("feeds/author/<str:username>/<str:fmt>/", feeds.author_feed,
+         name="author_feed"),
+    path("api/posts/", api.post_list, name="api_posts"),
+    path("api/posts/<int:post_id>/", api.post_detail, name="api_post"),
+    path("api/posts/<int:post_id>/comments/", api.post_comments,
+         name="api_post_comments"),
+    path("api/groups/", api.group_list, name="api_groups"),
+    path("api/groups/<slug:slug>/posts/", api.group_posts,
+         name="api_group_posts"),
+    path("api/users/<str:username>/", api.user_detail, name="api_user"),
+    path("api/users/<str:username>/posts/", api.user_posts,
+         name="api_user_posts"),
+    path("api/follow/", api.follow_index, name="api_follow"),
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
     path("<str:username>/unfollow/", views.profile_unfollow, name="profile_unfollow"),
     path("<str:username>/<int:post_id>/comment", views.add_comment, name='add_comment'),
     path("<str:username>/", views.profile, name='profile'),
     path("<str:username>/<int:post_id>/", views.post_view, name='post'),
+    path("<str:username>/<int:post_id>/comments/", views.post_comments,
+         name='post_comments'),
     path("<str:username>/<int:post_id>/edit/", views.post_edit, name='post_edit'),
 
 ]
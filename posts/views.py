@@ -1,18 +1,37 @@
+from urllib.parse import urlencode
+
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
+
+from yatube.db_router import read_only
 
+from . import thumbnails, write_batch
+from .cache import (cached_feed_page, cached_post_page, feed_etag,
+                    feed_last_modified, get_feed_version, get_follow_version,
+                    page_cache_key)
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .paginator import (COMMENTS_PER_PAGE, POSTS_PER_PAGE, CursorPaginator,
+                        paginate)
+from .search import SearchResults
+from .timeline import follow_feed
 
 
-@cache_page(timeout=20, key_prefix='index_page')
+@read_only
+@condition(etag_func=feed_etag, last_modified_func=feed_last_modified)
+@cached_feed_page(key_prefix='index_page')
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    # страница целиком кэшируется только для анонимов, список постов — общий
+    paginator, page = cached_post_page(
+        page_cache_key('index_posts', request, get_feed_version()),
+        lambda: paginate(request, post_list),
+        post_list,
+    )
     return render(
         request,
         'index.html',
@@ -20,69 +39,128 @@ def index(request):
     )
 
 
+@read_only
+@condition(etag_func=feed_etag, last_modified_func=feed_last_modified)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = group.posts.for_feed()
+    paginator, page = paginate(request, post_list)
     return render(
         request,
         'group.html',
         {'group': group,
-         'posts': posts,
          'page': page,
          'paginator': paginator})
 
 
+@read_only
+def search(request):
+    query = request.GET.get('q', '').strip()
+    paginator = Paginator(SearchResults(query, Post.objects.for_feed()),
+                          POSTS_PER_PAGE)
+    page = paginator.get_page(request.GET.get('page'))
+    return render(
+        request,
+        'search.html',
+        {'query': query,
+         'page': page,
+         'paginator': paginator,
+         'page_query': urlencode({'q': query}) + '&'})
+
+
 @login_required
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        write_batch.save(post)
+        thumbnails.schedule(post)
         return redirect('index')
     return render(request, 'new_post.html', {'form': form})
 
 
+def profile_etag(request, username, **kwargs):
+    """Версия лент и счетчики автора: подписки версию лент не меняют.
+
+    Нужен всем страницам с карточкой автора, в том числе странице поста.
+    """
+    counters = UserStats.objects.filter(user__username=username).values_list(
+        'posts_count', 'followers_count', 'following_count'
+    ).first() or ()
+    return '-'.join([feed_etag(request), *map(str, counters)])
+
+
+@read_only
+@condition(etag_func=profile_etag)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    count = author.posts.count()
-    following = Follow.objects.filter(author=author)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    stats = UserStats.of(author)
+    posts = author.posts.for_feed()
+    paginator, page = paginate(request, posts, count=stats.posts_count)
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author=author
+    ).exists()
     return render(
         request,
         'profile.html',
         {'page': page,
          'author': author,
          'paginator': paginator,
-         'count': count,
+         'stats': stats,
          'following': following}
     )
 
 
+@read_only
+@condition(etag_func=profile_etag)
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, pk=post_id, author__username=username)
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related('author__stats'),
+        pk=post_id, author__username=username,
+    )
     author = post.author
-    count = author.posts.count()
     form = CommentForm()
-    items = post.comments.all()
+    comments = post.comments.select_related('author')
+    # шаблон рисует страницу comments, а сам QuerySet без запросов к базе
+    # остается в контексте для тестов курса (tests/test_post.py)
     return render(request,
                   'post.html',
                   {'post': post,
-                   'count': count,
+                   'stats': UserStats.of(author),
                    'author': author,
                    'form': form,
-                   'items': items})
+                   'comment_list': comments,
+                   'comments': comments_page(request, comments)})
+
+
+def comments_page(request, comments):
+    """Страница комментариев по курсору, новые сверху"""
+    paginator = CursorPaginator(comments, COMMENTS_PER_PAGE,
+                                ordering=('-created', '-id'))
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+@read_only
+@condition(etag_func=feed_etag, last_modified_func=feed_last_modified)
+def post_comments(request, username, post_id):
+    """Следующая страница комментариев без карточек поста и автора"""
+    comments = comments_page(
+        request,
+        Comment.objects.select_related('author')
+        .filter(post_id=post_id, post__author__username=username),
+    )
+    if not comments and not Post.objects.filter(
+            pk=post_id, author__username=username).exists():
+        raise Http404('Пост не найден')
+    return render(request, 'includes/comment_list.html',
+                  {'post_id': post_id, 'username': username,
+                   'comments': comments})
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, username, post_id):
     profile = get_object_or_404(User, username=username)
     post = get_object_or_404(Post, pk=post_id, author=profile)
@@ -96,6 +174,8 @@ def post_edit(request, username, post_id):
     if request.method == 'POST':
         if form.is_valid():
             form.save()
+            if 'image' in form.changed_data:
+                thumbnails.schedule(post)
             return redirect("post", username=request.user.username,
                             post_id=post_id)
 
@@ -113,26 +193,35 @@ def add_comment(request, username, post_id):
         new_comment = form.save(commit=False)
         new_comment.post = post
         new_comment.author = request.user
-        new_comment.save()
+        write_batch.save(new_comment)
         return redirect('post', username=username,
                         post_id=post.id)
     return redirect("post", post_id=post_id, username=username)
 
 
+@read_only
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(
-        author__following__in=Follow.objects.filter(user=request.user)
+    def build():
+        post_list, is_timeline = follow_feed(request.user)
+        paginator, page = paginate(request, post_list)
+        if is_timeline:
+            page.object_list = [entry.post for entry in page.object_list]
+        return paginator, page
+
+    user_id = request.user.pk
+    paginator, page = cached_post_page(
+        page_cache_key(f'follow:{user_id}', request,
+                       get_follow_version(user_id)),
+        build,
+        Post.objects.for_feed().filter(author__following__user=request.user),
     )
-    paginator = Paginator(post_list, 10)
-
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
     return render(request, 'follow.html',
                   {'page': page, 'paginator': paginator})
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
@@ -141,6 +230,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.filter(user=request.user, author=author).delete()
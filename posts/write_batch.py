@@ -0,0 +1,191 @@
+"""Отложенная запись постов и комментариев пачками.
+
+SQLite пускает писать только одно соединение, и каждая вставка в отдельной
+транзакции заново берет блокировку и ждет сброса на диск. Когда включен
+settings.WRITE_BATCHING, объекты из всех запросов процесса копятся
+WRITE_BATCH_WINDOW секунд (не больше WRITE_BATCH_MAX штук) и сохраняются
+одним потоком в одной транзакции. Запрос ждет фиксации пачки, поэтому
+после редиректа запись уже в базе. Если пачка не взялась за объект за
+WRITE_BATCH_TIMEOUT секунд, запрос сохраняет его сам.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, TimeoutError
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# сколько последних пачек помнить для метрик
+HISTORY = 100
+
+BatchStats = namedtuple('BatchStats', 'size failed wait commit finished')
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+history = deque(maxlen=HISTORY)
+# счетчики с запуска процесса для Prometheus
+_totals = dict.fromkeys(('batches', 'rows', 'failed', 'wait', 'commit'), 0)
+_totals_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'WRITE_BATCHING', False)
+
+
+def save(obj):
+    """Сохраняет объект и возвращается только после фиксации транзакции.
+
+    Внутри чужой транзакции объект сохраняется сразу: иначе он оказался бы
+    в базе раньше, чем ее зафиксируют, или не попал бы туда вовсе.
+    """
+    if not is_enabled() or connection.in_atomic_block:
+        with transaction.atomic():
+            obj.save()
+        return obj
+    future = Future()
+    _queue.put((obj, future, time.monotonic()))
+    _ensure_worker()
+    timeout = getattr(settings, 'WRITE_BATCH_TIMEOUT', 5)
+    try:
+        future.result(timeout)
+    except TimeoutError:
+        if not future.cancel():
+            # пачка уже пишет объект: ждем ее, а не сохраняем второй раз
+            future.result(timeout)
+            return obj
+        logger.warning('Пачка не ответила за %s с, сохраняем %r сами',
+                       timeout, obj)
+        with transaction.atomic():
+            obj.save()
+    return obj
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='write-batch',
+                                       daemon=True)
+            _worker.start()
+
+
+def _collect():
+    """Первый объект ждем сколько угодно, остальные — до конца окна"""
+    batch = [_queue.get()]
+    deadline = time.monotonic() + settings.WRITE_BATCH_WINDOW
+    while len(batch) < settings.WRITE_BATCH_MAX:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(_queue.get(timeout=timeout))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _run():
+    while True:
+        batch = _collect()
+        try:
+            write(batch)
+        except Exception as error:
+            # поток должен жить дальше, а запросы — узнать об ошибке
+            logger.exception('Не удалось записать пачку из %d объектов',
+                             len(batch))
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            connection.close()
+
+
+def _save_all(batch, errors):
+    for obj, future, _ in batch:
+        try:
+            with transaction.atomic():
+                obj.save()
+        except Exception as error:
+            errors[id(future)] = error
+
+
+def write(batch):
+    """Сохраняет пачку (объект, future, время постановки) одной транзакцией.
+
+    Каждый объект пишется в своей точке сохранения, чтобы ошибка в одном
+    не откатывала остальные. Внешние ключи SQLite проверяет только при
+    фиксации; если она не прошла, объекты сохраняются по одному.
+    bulk_create не подходит: в SQLite он не возвращает id, а без сигналов
+    не обновятся счетчики, поиск и ленты.
+    """
+    # объекты, которые запрос уже сохранил сам, пропускаем
+    batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+    if not batch:
+        return None
+    started = time.monotonic()
+    states = [(obj.pk, obj._state.adding) for obj, _, _ in batch]
+    errors = {}
+    try:
+        with transaction.atomic():
+            _save_all(batch, errors)
+    except Exception:
+        logger.warning('Пачка из %d записей не зафиксирована, сохраняем '
+                       'по одной', len(batch), exc_info=True)
+        for (obj, _, _), (pk, adding) in zip(batch, states):
+            obj.pk, obj._state.adding = pk, adding
+        errors = {}
+        _save_all(batch, errors)
+    finished = time.monotonic()
+
+    for _, future, _ in batch:
+        error = errors.get(id(future))
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+    stats = BatchStats(
+        size=len(batch),
+        failed=len(errors),
+        wait=started - min(queued for _, _, queued in batch),
+        commit=finished - started,
+        finished=time.time(),
+    )
+    history.append(stats)
+    with _totals_lock:
+        _totals['batches'] += 1
+        _totals['rows'] += stats.size
+        _totals['failed'] += stats.failed
+        _totals['wait'] += stats.wait
+        _totals['commit'] += stats.commit
+    logger.info('Пачка: %d записей, ошибок %d, ожидание %.1f мс, '
+                'запись %.1f мс', stats.size, stats.failed,
+                stats.wait * 1000, stats.commit * 1000)
+    return stats
+
+
+def totals():
+    """Счетчики всех пачек с запуска процесса"""
+    with _totals_lock:
+        return dict(_totals)
+
+
+def metrics():
+    """Сводка по последним пачкам"""
+    batches = list(history)
+    if not batches:
+        return {'batches': 0}
+    return {
+        'batches': len(batches),
+        'rows': sum(stats.size for stats in batches),
+        'failed': sum(stats.failed for stats in batches),
+        'max_size': max(stats.size for stats in batches),
+        'mean_size': sum(stats.size for stats in batches) / len(batches),
+        'max_wait': max(stats.wait for stats in batches),
+        'mean_commit': (sum(stats.commit for stats in batches)
+                        / len(batches)),
+    }
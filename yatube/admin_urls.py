@@ -0,0 +1,6 @@
+"""Адреса админки; модуль импортируется при первом обращении к ним"""
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns, app_name, _ = admin.site.urls
@@ -0,0 +1,283 @@
+"""Кэши, общие для всех воркеров на одном сервере.
+
+SQLiteCache хранит записи в файле SQLite и вытесняет давно не читанные,
+когда превышены MAX_SIZE (байт) или MAX_ENTRIES. TieredCache держит перед
+общим кэшем маленький LRU в памяти процесса для горячих ключей.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    entries INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_stats VALUES (1, 0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+    UPDATE cache_stats SET entries = entries + 1, size = size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+    UPDATE cache_stats SET entries = entries - 1, size = size - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache BEGIN
+    UPDATE cache_stats SET size = size - OLD.size + NEW.size;
+END;
+"""
+
+
+class SQLiteCache(BaseCache):
+    # время последнего чтения обновляем не чаще, чем раз в столько секунд,
+    # чтобы чтения не превращались в запись
+    access_resolution = 10
+    cull_batch = 100
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self._path, timeout=5, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires, accessed = row
+        now = time.time()
+        if expires is not None and expires <= now:
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now)
+            )
+            return default
+        if now - accessed > self.access_resolution:
+            connection.execute(
+                'UPDATE cache SET accessed = ? WHERE key = ?', (now, key)
+            )
+        return pickle.loads(value)
+
+    def _write(self, key, value, timeout, replace):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now)
+            )
+            # INSERT OR REPLACE не вызывает триггер cache_delete, и
+            # cache_stats разошлась бы с таблицей; upsert идет через
+            # cache_update
+            conflict = ('DO UPDATE SET value = excluded.value, '
+                        'expires = excluded.expires, '
+                        'accessed = excluded.accessed, size = excluded.size'
+                        if replace else 'DO NOTHING')
+            cursor = connection.execute(
+                'INSERT INTO cache VALUES (?, ?, ?, ?, ?) '
+                f'ON CONFLICT (key) {conflict}',
+                (key, data, self.get_backend_timeout(timeout), now, len(data)),
+            )
+            written = cursor.rowcount == 1
+            if written:
+                self._cull(connection, now)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return written
+
+    def _cull(self, connection, now):
+        entries, size = connection.execute(
+            'SELECT entries, size FROM cache_stats'
+        ).fetchone()
+        if entries <= self._max_entries and size <= self._max_size:
+            return
+        connection.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        # вытеснение редкое, поэтому заодно сверяем счетчики с таблицей:
+        # в старых файлах кэша они могли разойтись
+        self._recount(connection)
+        # вытесняем давно не читанные записи, пока не освободим ~10% места
+        target_entries = self._max_entries * 9 // 10
+        target_size = self._max_size * 9 // 10
+        while True:
+            entries, size = connection.execute(
+                'SELECT entries, size FROM cache_stats'
+            ).fetchone()
+            if entries <= target_entries and size <= target_size:
+                break
+            batch = min(max(entries - target_entries, 1), self.cull_batch)
+            cursor = connection.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (batch,),
+            )
+            if cursor.rowcount == 0:
+                break
+
+    def _recount(self, connection):
+        connection.execute(
+            'UPDATE cache_stats SET (entries, size) = '
+            '(SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache)'
+        )
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._write(key, value, timeout, replace=True)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._write(key, value, timeout, replace=False)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        cursor = self._connection().execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        row = self._connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # соединение живет весь поток: открывать файл на каждый запрос дорого
+        pass
+
+
+class TieredCache(BaseCache):
+    """LRU в памяти процесса перед общим кэшем.
+
+    Локально хранятся только ключи с префиксами из LOCAL_KEY_PREFIXES и не
+    дольше LOCAL_TIMEOUT секунд: удаление в другом процессе до этой копии
+    не дойдет. Поэтому сюда стоит пускать ключи с версией в имени, значение
+    которых не меняется.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED', 'shared')
+        self._local_max_entries = int(options.get('LOCAL_MAX_ENTRIES', 128))
+        self._local_timeout = float(options.get('LOCAL_TIMEOUT', 60))
+        self._local_prefixes = tuple(options.get('LOCAL_KEY_PREFIXES', ()))
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _is_local(self, key):
+        return bool(self._local_prefixes) and key.startswith(
+            self._local_prefixes
+        )
+
+    def _remember(self, key, version, value):
+        with self._lock:
+            self._local[key, version] = (
+                time.monotonic() + self._local_timeout, value
+            )
+            self._local.move_to_end((key, version))
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _forget(self, key, version):
+        with self._lock:
+            self._local.pop((key, version), None)
+
+    def get(self, key, default=None, version=None):
+        if self._is_local(key):
+            with self._lock:
+                item = self._local.get((key, version))
+                if item is not None and item[0] > time.monotonic():
+                    self._local.move_to_end((key, version))
+                    return pickle.loads(item[1])
+        value = self.shared.get(key, default=default, version=version)
+        if value is not default and self._is_local(key):
+            self._remember(key, version, pickle.dumps(value))
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout=timeout, version=version)
+        if self._is_local(key):
+            self._remember(key, version, pickle.dumps(value))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added and self._is_local(key):
+            self._remember(key, version, pickle.dumps(value))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._forget(key, version)
+        self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._forget(key, version)
+        return self.shared.incr(key, delta=delta, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
@@ -0,0 +1,54 @@
+"""Чтение из отдельного соединения только для чтения, запись в основное.
+
+Представления, помеченные read_only, на GET и HEAD читают через базу
+READ_ALIAS: соединения с mode=ro и query_only никогда не берут блокировку
+записи и не ждут ее. Все записи и чтения внутри транзакций идут в основную
+базу.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+READ_ALIAS = 'read'
+
+_reading = ContextVar('reading', default=False)
+
+
+@contextmanager
+def reading():
+    token = _reading.set(True)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+def read_only(view):
+    """Читает данные представления через соединение только для чтения"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        with reading():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReadWriteRouter:
+    def db_for_read(self, model, **hints):
+        if (_reading.get() and READ_ALIAS in settings.DATABASES
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return READ_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,276 @@
+"""Метрики запросов по имени адреса в формате Prometheus.
+
+Для каждого имени маршрута (index, profile, post, ...) считаются запросы
+по статусам, гистограмма времени ответа, число и время запросов к базе,
+попадания и промахи кэша и время отрисовки шаблонов верхнего уровня.
+Отдельно отдаются счетчики пачек записи из posts.write_batch.
+Каждый поток пишет только в свой набор счетчиков, поэтому блокировок на
+пути запроса нет; metrics_view складывает наборы всех потоков процесса.
+
+Страница метрик открыта только адресам из METRICS_ALLOWED_IPS и запросам
+с заголовком "Authorization: Bearer <METRICS_TOKEN>". За прокси на том же
+сервере все запросы приходят с 127.0.0.1, поэтому по умолчанию список
+адресов пуст.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from posts import write_batch
+
+from .template_profiler import install_timing, timing
+
+# границы гистограммы времени ответа, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+_current = ContextVar('request_metrics', default=None)
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'query_time', 'cache_hits', 'cache_misses',
+                 'in_cache')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # вызов кэша изнутри другого вызова (get_many через get) не считаем
+        self.in_cache = False
+
+
+class ViewStats:
+    def __init__(self):
+        self.statuses = Counter()
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.duration = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.template_time = 0.0
+
+    def add(self, status, duration, request_metrics, template_time):
+        self.statuses[status] += 1
+        for number, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                self.buckets[number] += 1
+                break
+        self.duration += duration
+        self.queries += request_metrics.queries
+        self.query_time += request_metrics.query_time
+        self.cache_hits += request_metrics.cache_hits
+        self.cache_misses += request_metrics.cache_misses
+        self.template_time += template_time
+
+    def merge(self, other):
+        # dict() копирует атомарно, пока поток-владелец пишет дальше
+        self.statuses.update(dict(other.statuses))
+        self.buckets = [mine + theirs for mine, theirs
+                        in zip(self.buckets, other.buckets)]
+        for name in ('duration', 'queries', 'query_time', 'cache_hits',
+                     'cache_misses', 'template_time'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+def _shard():
+    """Счетчики текущего потока; блокировка только при первом запросе"""
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = defaultdict(ViewStats)
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def collect():
+    """Сумма счетчиков всех потоков по имени адреса"""
+    total = defaultdict(ViewStats)
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        for view, stats in list(shard.items()):
+            total[view].merge(stats)
+    return total
+
+
+def _count_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.query_time += time.perf_counter() - started
+
+
+def _instrument_cache(cache):
+    """Считает попадания и промахи одного экземпляра кэша.
+
+    Оборачивается экземпляр, а не класс: другие псевдонимы с тем же
+    бэкендом не задеваются.
+    """
+    if getattr(cache, '_metrics_counted', False):
+        return
+    get, get_many = cache.get, cache.get_many
+    missing = object()
+
+    def counted_get(key, default=None, version=None):
+        metrics = _current.get()
+        if metrics is None or metrics.in_cache:
+            return get(key, default, version)
+        metrics.in_cache = True
+        try:
+            value = get(key, missing, version)
+        finally:
+            metrics.in_cache = False
+        if value is missing:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+
+    def counted_get_many(keys, version=None):
+        metrics = _current.get()
+        if metrics is None or metrics.in_cache:
+            return get_many(keys, version)
+        keys = list(keys)
+        metrics.in_cache = True
+        try:
+            values = get_many(keys, version)
+        finally:
+            metrics.in_cache = False
+        metrics.cache_hits += len(values)
+        metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    cache.get = counted_get
+    cache.get_many = counted_get_many
+    cache._metrics_counted = True
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        install_timing()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # у каждого потока свой экземпляр кэша
+        _instrument_cache(caches['default'])
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack, timing() as timer:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(_count_query)
+                    )
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unnamed'
+        _shard()[view].add(response.status_code, duration, metrics,
+                           timer.total)
+        return response
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{value}"'
+                          for name, value in labels.items()) + '}'
+
+
+def render_metrics(stats_by_view, batch_totals=None):
+    lines = []
+
+    def family(name, kind, description, samples):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+
+    views = sorted(stats_by_view.items())
+    family('yatube_requests_total', 'counter', 'Requests by URL name.', [
+        f'yatube_requests_total{_labels(view=view, status=status)} {count}'
+        for view, stats in views
+        for status, count in sorted(stats.statuses.items())
+    ])
+    histogram = []
+    for view, stats in views:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+            cumulative += count
+            histogram.append(
+                'yatube_request_duration_seconds_bucket'
+                f'{_labels(view=view, le=bound)} {cumulative}'
+            )
+        requests = sum(stats.statuses.values())
+        histogram += [
+            'yatube_request_duration_seconds_bucket'
+            f'{_labels(view=view, le="+Inf")} {requests}',
+            'yatube_request_duration_seconds_sum'
+            f'{_labels(view=view)} {stats.duration:.6f}',
+            'yatube_request_duration_seconds_count'
+            f'{_labels(view=view)} {requests}',
+        ]
+    family('yatube_request_duration_seconds', 'histogram',
+           'Response time by URL name.', histogram)
+    for name, attribute, description in (
+            ('yatube_db_queries_total', 'queries', 'Database queries.'),
+            ('yatube_db_query_seconds_total', 'query_time',
+             'Time spent in database queries.'),
+            ('yatube_cache_hits_total', 'cache_hits', 'Cache hits.'),
+            ('yatube_cache_misses_total', 'cache_misses', 'Cache misses.'),
+            ('yatube_template_render_seconds_total', 'template_time',
+             'Time spent rendering templates.')):
+        family(name, 'counter', description, [
+            f'{name}{_labels(view=view)} {getattr(stats, attribute)}'
+            for view, stats in views
+        ])
+    if batch_totals is not None:
+        batches, rows = batch_totals['batches'], batch_totals['rows']
+        family('yatube_write_batch_size', 'summary',
+               'Rows per write batch.', [
+                   f'yatube_write_batch_size_sum {rows}',
+                   f'yatube_write_batch_size_count {batches}',
+               ])
+        for name, key, description in (
+                ('yatube_write_batch_failures_total', 'failed',
+                 'Rows that failed inside a write batch.'),
+                ('yatube_write_batch_wait_seconds_total', 'wait',
+                 'Time the oldest row of each batch waited in the queue.'),
+                ('yatube_write_batch_commit_seconds_total', 'commit',
+                 'Time spent writing and committing batches.')):
+            family(name, 'counter', description,
+                   [f'{name} {batch_totals[key]}'])
+    return '\n'.join(lines) + '\n'
+
+
+def _allowed(request):
+    if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and constant_time_compare(authorization,
+                                                 f'Bearer {token}')
+
+
+def metrics_view(request):
+    """Страница для Prometheus: по адресу из списка или по токену"""
+    if not _allowed(request):
+        raise Http404
+    return HttpResponse(render_metrics(collect(), write_batch.totals()),
+                        content_type='text/plain; version=0.0.4')
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -20,8 +21,9 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [TEMPLATES_DIR],
-        "APP_DIRS": True,
         "OPTIONS": {
+            # загрузчики задаются ниже, после DEBUG
+            "loaders": [],
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
@@ -41,6 +43,18 @@ SECRET_KEY = '!9ntokp@%5&gl$856w9-h6p#*31ocfb2e&oolaxusiwc8k4m06'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# При разработке шаблоны читаются с диска заново, чтобы правки были видны
+# без перезапуска. Боевые настройки и бенчмарки оборачивают эти загрузчики
+# в cached.Loader
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+TEMPLATES[0]['OPTIONS']['loaders'] = TEMPLATE_LOADERS
+
+# Время отрисовки шаблонов и include в логе и заголовке Server-Timing
+TEMPLATE_PROFILING = bool(os.environ.get('YATUBE_TEMPLATE_PROFILING'))
+
 ALLOWED_HOSTS = [
     "localhost",
     "127.0.0.1",
@@ -61,12 +75,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
     'sorl.thumbnail',
 ]
 
 MIDDLEWARE = [
-
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.slow_queries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,9 +88,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'yatube.template_profiler.TemplateProfilerMiddleware',
 ]
 
+# debug toolbar только для отладки и только если пакет установлен
+if DEBUG and find_spec('debug_toolbar'):
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'yatube.urls'
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
@@ -86,11 +105,25 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # sqlite3 с WAL и PRAGMA из yatube/sqlite/base.py
+        'ENGINE': 'yatube.sqlite',
+        'NAME': os.environ.get('YATUBE_DB',
+                               os.path.join(BASE_DIR, 'db.sqlite3')),
     }
 }
 
+# Отдельное соединение только для чтения для представлений с read_only:
+# YATUBE_READ_CONNECTION=1. В тестах это то же соединение, что и default
+if os.environ.get('YATUBE_READ_CONNECTION'):
+    DATABASES['read'] = {
+        'ENGINE': 'yatube.sqlite',
+        'NAME': f"file:{DATABASES['default']['NAME']}?mode=ro",
+        # режим журнала выставляет основное соединение
+        'OPTIONS': {'pragmas': {'query_only': 'ON', 'journal_mode': None}},
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['yatube.db_router.ReadWriteRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -138,16 +171,94 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Flatpages, отрисованные командой prerender_flatpages при выкладке.
+# Приложение сверяет файл с текущей FlatPage и устаревший не отдает. Если
+# веб-сервер отдает <url>/index.html отсюда сам, команду нужно запускать
+# на каждом сервере после каждой правки страниц
+FLATPAGES_PRERENDER_DIR = os.path.join(BASE_DIR, 'prerendered')
+
 INTERNAL_IPS = [
     '127.0.0.1'
 ]
+# Кто может забирать /metrics: адреса или заголовок
+# "Authorization: Bearer <токен>". За локальным прокси у всех 127.0.0.1
+METRICS_ALLOWED_IPS = []
+METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN')
+
+# Запросы к базе дольше порога (секунды) пишутся в лог с планом
+# выполнения; None выключает журнал. Команда slow_queries показывает
+# худшие из SLOW_QUERY_MAX_SHAPES последних форм запросов
+SLOW_QUERY_THRESHOLD = 0.1
+SLOW_QUERY_MAX_SHAPES = 200
 EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 SITE_ID = 1
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Процессы, готовящие миниатюры картинок после публикации поста;
+# 0 — готовить сразу в процессе запроса
+THUMBNAIL_WORKERS = 2
+
+# Постраничный вывод лент: "offset" (номера страниц) или "cursor"
+# (по ключу pub_date, id — без COUNT(*) и OFFSET)
+POSTS_PAGINATION = 'offset'
+
+# Лента подписок из заранее разложенных по читателям записей. После
+# включения ленты нужно собрать командой "timelines --rebuild"
+FOLLOW_TIMELINE = False
+# Посты авторов с большим числом подписчиков подмешиваются при чтении
+TIMELINE_FANOUT_LIMIT = 10000
+TIMELINE_MAX_ENTRIES = 1000
+
+# Отложенная запись постов и комментариев: вставки из разных запросов
+# копятся WRITE_BATCH_WINDOW секунд и фиксируются одной транзакцией
+WRITE_BATCHING = False
+WRITE_BATCH_WINDOW = 0.005
+WRITE_BATCH_MAX = 100
+# сколько запрос ждет пачку, прежде чем сохранить объект сам
+WRITE_BATCH_TIMEOUT = 5
+
+# Кэш: "locmem" — свой в каждом процессе (для разработки и тестов),
+# "shared" — один файл SQLite на всех воркеров сервера, "tiered" — общий
+# файл и маленький LRU в памяти процесса для первой страницы ленты и
+# карточек постов
+CACHE_MODE = os.environ.get('YATUBE_CACHE', 'locmem')
+
+SHARED_CACHE = {
+    'BACKEND': 'yatube.cache_backends.SQLiteCache',
+    'LOCATION': os.path.join(BASE_DIR, 'cache', 'shared.sqlite3'),
+    'OPTIONS': {
+        'MAX_ENTRIES': 100000,
+        'MAX_SIZE': 256 * 1024 * 1024,
+    },
+}
+
+if CACHE_MODE == 'shared':
+    CACHES = {'default': SHARED_CACHE}
+elif CACHE_MODE == 'tiered':
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.cache_backends.TieredCache',
+            'OPTIONS': {
+                'SHARED': 'shared',
+                'LOCAL_MAX_ENTRIES': 512,
+                'LOCAL_TIMEOUT': 60,
+                'LOCAL_KEY_PREFIXES': ['feed:index_page:', 'post_card:',
+                                       'flatpage:'],
+            },
+        },
+        'shared': SHARED_CACHE,
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
\ No newline at end of file
+
+# Страницы лент живут в кэше долго: их версия меняется при любом изменении
+# постов, комментариев и групп. Но в кэше процесса версию меняет только тот
+# воркер, который сохранил пост, поэтому без общего кэша и страницы, и сами
+# версии живут недолго, как прежний cache_page(20)
+CACHE_IS_SHARED = CACHE_MODE in ('shared', 'tiered')
+FEED_CACHE_TIMEOUT = 60 * 60 * 24 if CACHE_IS_SHARED else 20
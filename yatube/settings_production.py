@@ -0,0 +1,40 @@
+"""Настройки боевого сервера: DJANGO_SETTINGS_MODULE=yatube.settings_production
+
+Без приложений и middleware для отладки, с кэшем скомпилированных шаблонов.
+Админка не ищет модули admin при запуске процесса: они импортируются при
+первом обращении к ее адресам, как и представления flatpages.
+Кэш по умолчанию "tiered": воркеры делят версии лент, ETag и журнал
+медленных запросов через файл SQLite; YATUBE_CACHE по-прежнему главнее.
+"""
+import os
+
+os.environ.setdefault('YATUBE_CACHE', 'tiered')
+
+from .settings import *  # noqa: F401,F403,E402
+from .settings import (INSTALLED_APPS, MIDDLEWARE, SECRET_KEY,  # noqa: E402
+                       TEMPLATE_LOADERS, TEMPLATES)
+
+DEBUG = False
+
+SECRET_KEY = os.environ.get('YATUBE_SECRET_KEY', SECRET_KEY)
+
+ALLOWED_HOSTS = os.environ.get('YATUBE_ALLOWED_HOSTS', 'localhost').split(',')
+
+DEV_APPS = ('debug_toolbar',)
+INSTALLED_APPS = [
+    'django.contrib.admin.apps.SimpleAdminConfig'
+    if app == 'django.contrib.admin' else app
+    for app in INSTALLED_APPS if app not in DEV_APPS
+]
+MIDDLEWARE = [
+    middleware for middleware in MIDDLEWARE
+    if not middleware.startswith(DEV_APPS)
+]
+
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+]
+TEMPLATES[0]['OPTIONS']['context_processors'] = [
+    processor for processor in TEMPLATES[0]['OPTIONS']['context_processors']
+    if processor != 'django.template.context_processors.debug'
+]
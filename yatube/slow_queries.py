@@ -0,0 +1,133 @@
+"""Журнал медленных запросов к базе с планом выполнения.
+
+Запрос дольше settings.SLOW_QUERY_THRESHOLD секунд пишется в лог вместе с
+представлением и шаблоном, из которых он выполнен. Запросы сводятся к
+отпечатку: значения и списки IN заменяются на ?, так что запросы одной
+формы считаются вместе. Для новой формы один раз снимается EXPLAIN QUERY
+PLAN. Отпечатки лежат в кэше 'shared' (или 'default', если его нет), не
+больше SLOW_QUERY_MAX_SHAPES, давно не встречавшиеся вытесняются; команда
+slow_queries показывает худшие. Команда — отдельный процесс, поэтому журнал
+из кэша в памяти процесса (YATUBE_CACHE=locmem) ей не виден.
+Счетчики приблизительные: процессы дополняют запись без блокировки.
+"""
+import logging
+import re
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .template_profiler import current_template, install_timing, timing
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'slow_queries'
+
+_view = ContextVar('slow_query_view', default=None)
+
+_NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    """Форма запроса без значений параметров"""
+    for pattern, replacement in _NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def explain(connection, sql, params):
+    """План запроса в обход обработчиков execute, чтобы не попасть в журнал"""
+    prefix = ('EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite'
+              else 'EXPLAIN ')
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(prefix + sql, params)
+        return [' '.join(str(value) for value in row)
+                for row in cursor.fetchall()]
+    except Exception as error:
+        return [f'EXPLAIN не удался: {error}']
+    finally:
+        cursor.close()
+
+
+def store():
+    """Кэш журнала: общий для процессов, если такой настроен"""
+    return caches['shared' if 'shared' in settings.CACHES else 'default']
+
+
+def is_process_local():
+    return isinstance(store(), LocMemCache)
+
+
+def shapes():
+    return store().get(CACHE_KEY) or {}
+
+
+def record(connection, sql, params, duration):
+    key = fingerprint(sql)
+    view, template = _view.get(), current_template()
+    stored = shapes()
+    shape = stored.pop(key, None)
+    if shape is None:
+        shape = {'sql': sql, 'count': 0, 'total': 0.0, 'max': 0.0,
+                 'plan': explain(connection, sql, params)}
+    shape.update(count=shape['count'] + 1, total=shape['total'] + duration,
+                 max=max(shape['max'], duration), last_seen=time.time(),
+                 view=view, template=template)
+    # словарь хранит порядок: последний встреченный отпечаток в конце
+    stored[key] = shape
+    while len(stored) > settings.SLOW_QUERY_MAX_SHAPES:
+        del stored[next(iter(stored))]
+    store().set(CACHE_KEY, stored, None)
+
+    logger.warning('Медленный запрос %.1f мс, представление %s, шаблон %s\n'
+                   '%s\n%s', duration * 1000, view, template, sql,
+                   '\n'.join(shape['plan']))
+
+
+def _log_slow(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        if duration >= settings.SLOW_QUERY_THRESHOLD and not many:
+            try:
+                record(context['connection'], sql, params, duration)
+            except Exception:
+                # журнал не должен ломать сам запрос
+                logger.exception('Не удалось записать медленный запрос')
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        if getattr(settings, 'SLOW_QUERY_THRESHOLD', None) is None:
+            raise MiddlewareNotUsed
+        install_timing()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _view.set(None)
+        try:
+            with ExitStack() as stack, timing():
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(_log_slow)
+                    )
+                return self.get_response(request)
+        finally:
+            _view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _view.set(f'{view_func.__module__}.{view_func.__name__}')
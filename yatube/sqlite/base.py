@@ -0,0 +1,35 @@
+"""SQLite с настройками для нескольких одновременных воркеров.
+
+WAL разрешает читать во время записи, synchronous=NORMAL в режиме WAL
+сбрасывает на диск только при контрольной точке, busy_timeout заставляет
+ждать блокировку записи вместо немедленной ошибки "database is locked".
+PRAGMA задаются в OPTIONS['pragmas'] базы и применяются к каждому новому
+соединению; None отключает PRAGMA по умолчанию.
+"""
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    # отрицательное значение — размер в КиБ, здесь 64 МиБ на соединение
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        pragmas = dict(DEFAULT_PRAGMAS,
+                       **self.settings_dict['OPTIONS'].get('pragmas', {}))
+        for name, value in pragmas.items():
+            if value is not None:
+                connection.execute(f'PRAGMA {name} = {value}')
+        return connection
@@ -0,0 +1,178 @@
+"""Время отрисовки каждого шаблона и include за запрос.
+
+Включается settings.TEMPLATE_PROFILING. Для каждого шаблона считаются
+число отрисовок, полное время и собственное время без вложенных include.
+Сводка по запросу уходит в лог yatube.template_profiler и в заголовок
+Server-Timing, который показывают инструменты разработчика в браузере.
+
+Для метрик и журнала медленных запросов есть легкий вариант, timing():
+он засекает только отрисовку шаблонов верхнего уровня и помнит их имя.
+"""
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template.backends import django as django_backend
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+# сколько самых дорогих шаблонов попадает в Server-Timing
+SERVER_TIMING_ENTRIES = 10
+
+_profile = ContextVar('template_profile', default=None)
+_original_render = None
+_timer = ContextVar('template_timer', default=None)
+_original_backend_render = None
+
+
+class RenderProfile:
+    def __init__(self):
+        # имя шаблона: [число отрисовок, полное время, собственное время]
+        self.templates = defaultdict(lambda: [0, 0.0, 0.0])
+        self.nested = [0.0]
+        self.rendering = []
+
+    def render(self, template, context):
+        name = template.name or '<string>'
+        self.nested.append(0.0)
+        self.rendering.append(name)
+        started = time.perf_counter()
+        try:
+            return _original_render(template, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self.nested.pop()
+            self.rendering.pop()
+            self.nested[-1] += elapsed
+            stats = self.templates[name]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += elapsed - children
+
+    @property
+    def total(self):
+        """Время отрисовки шаблонов верхнего уровня"""
+        return self.nested[0]
+
+    def by_self_time(self):
+        return sorted(self.templates.items(), key=lambda item: -item[1][2])
+
+    def server_timing(self):
+        entries = []
+        for number, (name, (calls, _, own)) in enumerate(
+                self.by_self_time()[:SERVER_TIMING_ENTRIES]):
+            entries.append(f'tpl{number};desc="{name} x{calls}"'
+                           f';dur={own * 1000:.2f}')
+        return ', '.join(entries)
+
+
+def _profiled_render(template, context):
+    profile = _profile.get()
+    if profile is None:
+        return _original_render(template, context)
+    return profile.render(template, context)
+
+
+@contextmanager
+def profiling():
+    """Профиль текущего запроса; вложенный вызов получает тот же профиль"""
+    profile = _profile.get()
+    if profile is not None:
+        yield profile
+        return
+    profile = RenderProfile()
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _profile.reset(token)
+
+
+class RenderTimer:
+    __slots__ = ('total', 'template')
+
+    def __init__(self):
+        self.total = 0.0
+        self.template = None
+
+
+def _timed_render(template, context=None, request=None):
+    timer = _timer.get()
+    # render_to_string внутри отрисовки уже засечен внешним шаблоном
+    if timer is None or timer.template is not None:
+        return _original_backend_render(template, context, request)
+    timer.template = template.origin.template_name
+    started = time.perf_counter()
+    try:
+        return _original_backend_render(template, context, request)
+    finally:
+        timer.total += time.perf_counter() - started
+        timer.template = None
+
+
+@contextmanager
+def timing():
+    """Время отрисовки шаблонов верхнего уровня за запрос"""
+    timer = _timer.get()
+    if timer is not None:
+        yield timer
+        return
+    timer = RenderTimer()
+    token = _timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _timer.reset(token)
+
+
+def current_template():
+    """Имя шаблона, который сейчас отрисовывается, или None.
+
+    Без профилировщика известен только шаблон верхнего уровня.
+    """
+    profile = _profile.get()
+    if profile is not None and profile.rendering:
+        return profile.rendering[-1]
+    timer = _timer.get()
+    return timer.template if timer is not None else None
+
+
+def install_timing():
+    global _original_backend_render
+    if _original_backend_render is None:
+        _original_backend_render = django_backend.Template.render
+        django_backend.Template.render = _timed_render
+
+
+def install():
+    global _original_render
+    if _original_render is None:
+        _original_render = Template._render
+        Template._render = _profiled_render
+
+
+class TemplateProfilerMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'TEMPLATE_PROFILING', False):
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profiling() as profile:
+            response = self.get_response(request)
+        if profile.templates:
+            response['Server-Timing'] = profile.server_timing()
+            logger.info('%s %s\n%s', request.method, request.path,
+                        '\n'.join(
+                            f'{own * 1000:8.2f} {total * 1000:8.2f} '
+                            f'{calls:5d}  {name}'
+                            for name, (calls, total, own)
+                            in profile.by_self_time()
+                        ))
+        return response
@@ -1,31 +1,65 @@
 from django.conf import settings
 from django.conf.urls import handler404, handler500
 from django.conf.urls.static import static
-from django.contrib import admin
-from django.contrib.flatpages import views
-from django.urls import include, path
+from django.urls import URLResolver, include, path
+from django.urls.resolvers import RoutePattern
+
+from posts.flatpages import flatpage
+from yatube.metrics import metrics_view
+
+
+class LazyURLResolver(URLResolver):
+    """Адреса с пространством имен, модуль которых импортируется только при
+    разборе этих адресов или построении ссылок на них, а не при первом
+    reverse() на любой странице"""
+
+    def _load(self):
+        return self.urlconf_module
+
+    def _populate(self):
+        if 'urlconf_module' in self.__dict__:
+            super()._populate()
+
+    @property
+    def reverse_dict(self):
+        self._load()
+        return super().reverse_dict
+
+    @property
+    def namespace_dict(self):
+        self._load()
+        return super().namespace_dict
+
+    @property
+    def app_dict(self):
+        self._load()
+        return super().app_dict
+
+
+def lazy_include(route, urlconf, namespace):
+    return LazyURLResolver(RoutePattern(route, is_endpoint=False), urlconf,
+                           app_name=namespace, namespace=namespace)
+
 
 urlpatterns = [
+    path('metrics', metrics_view, name='metrics'),
+    # раньше posts.urls, иначе адреса заберет профиль автора <username>/
+    path('about-us/', flatpage, {'url': '/about-us/'}, name='about'),
+    path('terms/', flatpage, {'url': '/terms/'}, name='terms'),
+    path('about-author/', flatpage,
+         {'url': '/about-author/'}, name='about-author'),
+    path('about-spec/', flatpage, {'url': '/about-spec/'}, name='about-spec'),
+    path('about/<path:url>', flatpage, name='flatpage'),
     path('', include("posts.urls"), name='index'),
-    path('about/', include('django.contrib.flatpages.urls')),
     path('auth/', include('users.urls'), name='auth'),
     path('auth/', include('django.contrib.auth.urls')),
-    path('admin/admin', admin.site.urls),
-]
-
-urlpatterns += [
-        path('about-us/', views.flatpage, {'url': '/about-us/'}, name='about'),
-        path('terms/', views.flatpage, {'url': '/terms/'}, name='terms'),
-        path('about-author/', views.flatpage,
-             {'url': '/about-author/'}, name='about-author'),
-        path('about-spec/', views.flatpage,
-             {'url': '/about-spec/'}, name='about-spec'),
+    lazy_include('admin/admin', 'yatube.admin_urls', namespace='admin'),
 ]
 
 handler404 = 'posts.views.page_not_found'# noqa
 handler500 = 'posts.views.server_error' # noqa
 
-if settings.DEBUG:
+if settings.DEBUG and 'debug_toolbar' in settings.INSTALLED_APPS:
     import debug_toolbar
 
     urlpatterns = [
@@ -34,4 +68,4 @@ if settings.DEBUG:
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)